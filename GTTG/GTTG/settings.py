@@ -10,8 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 import environ
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -135,6 +137,41 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# orjson for JSON; MessagePack for clients that ask for it (the bot does)
+API_RENDERERS = ['GTTG.bot.renderers.ORJSONRenderer']
+API_PARSERS = ['GTTG.bot.renderers.ORJSONParser']
+if find_spec('msgpack'):
+    API_RENDERERS.append('GTTG.bot.renderers.MessagePackRenderer')
+    API_PARSERS.append('GTTG.bot.renderers.MessagePackParser')
+
+# Lists stay plain arrays unless ?cursor= / ?page_size= is passed
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'GTTG.bot.pagination.OptionalCursorPagination',
+    'DEFAULT_RENDERER_CLASSES': API_RENDERERS + ['rest_framework.renderers.BrowsableAPIRenderer'],
+    'DEFAULT_PARSER_CLASSES': API_PARSERS + [
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_CONTENT_NEGOTIATION_CLASS': 'GTTG.bot.renderers.ClientPreferenceNegotiation',
+}
+
 # Behind Railway proxy
 USE_X_FORWARDED_HOST = True
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+
+# Shared with the bot worker (catalog cache invalidation)
+REDIS_URL = env('REDIS_URL', default='')
+
+# Telegram webhook (alternative to long polling in the worker)
+TELEGRAM_BOT_TOKEN = env('TELEGRAM_BOT_TOKEN', default='')
+TELEGRAM_WEBHOOK_URL = env('TELEGRAM_WEBHOOK_URL', default='')
+TELEGRAM_WEBHOOK_SECRET = env('TELEGRAM_WEBHOOK_SECRET', default='')
+TELEGRAM_WEBHOOK_WORKERS = env.int('TELEGRAM_WEBHOOK_WORKERS', default=8)
+
+# Hand webhook updates to Redis Streams for the `--runtime stream` workers
+# instead of processing them in the web process
+TELEGRAM_UPDATE_STREAM = env.bool('TELEGRAM_UPDATE_STREAM', default=False)
+UPDATE_STREAM_PARTITIONS = env.int('UPDATE_STREAM_PARTITIONS', default=16)
+if TELEGRAM_UPDATE_STREAM and not REDIS_URL:
+    # otherwise every webhook update would fail with a 500
+    raise ImproperlyConfigured("TELEGRAM_UPDATE_STREAM needs REDIS_URL")
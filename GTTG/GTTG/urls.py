@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.urls import path, include
+from GTTG.bot.webhook import telegram_webhook
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('GTTG.bot.urls')),
+    path('telegram/webhook/', telegram_webhook),
 ]
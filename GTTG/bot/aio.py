@@ -0,0 +1,204 @@
+import asyncio
+import inspect
+import logging
+import os
+import time
+
+import aiohttp
+import redis.asyncio as aioredis
+import requests
+from telebot import apihelper
+from telebot.async_telebot import AsyncTeleBot
+
+from .api_client import ACCEPT, ApiResponse, Attempts, BaseApiClient
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# The async runtime keeps the handlers in bot.py as they are, blocking code
+# on handler threads; what moves onto the single event loop is their network
+# I/O (Telegram, Redis, the Django API), multiplexed over pooled async
+# clients. A handler thread is held for the whole of each call it makes, so
+# at most BOT_ASYNC_WORKERS updates are handled at once: the same bound as
+# the sync runtime with that many workers, with fewer sockets and
+# connections. Updates go through bot.dispatch(), so one chat's updates still
+# run one at a time, in order.
+
+
+class AsyncApiClient(BaseApiClient):
+    def __init__(self, base_url, pool_size=100, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.pool_size = pool_size
+        self.session = None
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30)
+        self.session = aiohttp.ClientSession(connector=connector, headers={"Accept": ACCEPT})
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def request(self, method, path, params=None, json=None, headers=None, timeout=None):
+        attempts = Attempts(self, method, path, timeout)
+        connect, read = attempts.timeout
+        for delay in attempts:
+            if delay:
+                await asyncio.sleep(delay)
+            started = time.perf_counter()
+            try:
+                async with self.session.request(
+                    attempts.method, attempts.url, params=params, json=json, headers=headers,
+                    timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read),
+                ) as resp:
+                    content = await resp.read()
+                    received = ApiResponse(resp.status, content, resp.headers, str(resp.url), reason=resp.reason)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                attempts.failed(started, e)
+                continue
+            if attempts.received(started, received):
+                break
+        return attempts.result()
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.request("PUT", path, **kwargs)
+
+    async def patch(self, path, **kwargs):
+        return await self.request("PATCH", path, **kwargs)
+
+    async def delete(self, path, **kwargs):
+        return await self.request("DELETE", path, **kwargs)
+
+
+class LoopBridge:
+    # Lets handler threads call an asyncio client as if it were synchronous.
+    # Must never be used from the loop thread itself.
+
+    def __init__(self, target, loop):
+        self._target = target
+        self._loop = loop
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self._wrap(attr(*args, **kwargs))
+        return call
+
+    def _wrap(self, result):
+        if inspect.isawaitable(result):
+            return asyncio.run_coroutine_threadsafe(_awaited(result), self._loop).result()
+        if hasattr(result, "execute"):
+            # redis pipelines queue commands synchronously and only execute() awaits
+            return LoopBridge(result, self._loop)
+        return result
+
+
+async def _awaited(awaitable):
+    return await awaitable
+
+
+def _query_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value if isinstance(value, (str, int, float)) else str(value)
+
+
+def make_telegram_sender(session, loop):
+    # Replaces telebot's requests-based transport for outgoing Bot API calls.
+    async def send(method, url, params, timeout):
+        connect, read = timeout
+        query = {k: _query_value(v) for k, v in (params or {}).items() if v is not None}
+        started = time.perf_counter()
+        async with session.request(
+            method.upper(), url, params=query,
+            timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read),
+        ) as resp:
+            content = await resp.read()
+        metrics.observe("telegram." + url.rsplit("/", 1)[-1], time.perf_counter() - started)
+        return ApiResponse(resp.status, content, resp.headers, url, reason=resp.reason)
+
+    def sender(method, url, params=None, files=None, timeout=(3.05, 25), proxies=None):
+        if files:
+            return requests.request(method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+        return asyncio.run_coroutine_threadsafe(send(method, url, params, timeout), loop).result()
+
+    return sender
+
+
+async def _poll(abot, dispatch, skip_pending=True, timeout=20):
+    offset = None
+    if skip_pending:
+        pending = await abot.get_updates(offset=-1, timeout=0)
+        if pending:
+            offset = pending[-1].update_id + 1
+    while True:
+        try:
+            updates = await abot.get_updates(offset=offset, timeout=timeout, request_timeout=timeout + 10)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("getUpdates failed: %s", e)
+            await asyncio.sleep(3)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            await dispatch(update)
+
+
+async def serve(bot_module, workers=None, skip_pending=True):
+    loop = asyncio.get_running_loop()
+    workers = workers or int(os.getenv("BOT_ASYNC_WORKERS", 64))
+
+    api = AsyncApiClient(bot_module.API_URL, pool_size=int(os.getenv("API_POOL_SIZE", 100)))
+    await api.start()
+    redis = aioredis.Redis.from_url(
+        bot_module.REDIS_URL, decode_responses=True,
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 100)),
+    )
+    session_redis = aioredis.Redis.from_url(
+        bot_module.REDIS_URL, max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 100)),
+    )
+    telegram = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=30))
+
+    bot_module.use_clients(
+        api_client=LoopBridge(api, loop),
+        redis=LoopBridge(redis, loop),
+        session_redis=LoopBridge(session_redis, loop),
+    )
+    sender = make_telegram_sender(telegram, loop)
+    if bot_module.OUTBOUND_PIPELINE:
+        bot_module.outbound.install(sender)
+    else:
+        apihelper.CUSTOM_REQUEST_SENDER = sender
+    bot_module.chats.start(workers)
+
+    async def dispatch(update):
+        # queues the update on its chat's lane; never blocks the loop
+        bot_module.dispatch(update)
+
+    abot = AsyncTeleBot(bot_module.TOKEN)
+    try:
+        await _poll(abot, dispatch, skip_pending=skip_pending)
+    finally:
+        if bot_module.OUTBOUND_PIPELINE:
+            bot_module.outbound.install()
+        else:
+            apihelper.CUSTOM_REQUEST_SENDER = None
+        await abot.close_session()
+        await telegram.close()
+        await api.close()
+        await redis.aclose()
+        await session_redis.aclose()
+
+
+def run_async(bot_module, **kwargs):
+    asyncio.run(serve(bot_module, **kwargs))
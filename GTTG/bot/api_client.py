@@ -0,0 +1,273 @@
+import json
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+RETRYABLE_STATUSES = frozenset({502, 503, 504})
+
+# (connect, read) seconds; keyed by the first path segment of the endpoint
+DEFAULT_TIMEOUT = (3.05, 10)
+ENDPOINT_TIMEOUTS = {
+    "auth-user": (3.05, 5),
+    "users": (3.05, 5),
+    "muscle-groups": (3.05, 10),
+    "exercises": (3.05, 20),
+    "catalog": (3.05, 20),
+    "workouts": (3.05, 15),
+}
+
+SLOW_CALL_SECONDS = 1.0
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+# ask for the compact encoding; an API without msgpack answers in JSON
+ACCEPT = f"{MSGPACK_MEDIA_TYPE}, application/json;q=0.9" if msgpack is not None else "application/json"
+
+
+class ApiResponse:
+    def __init__(self, status_code, content=b"", headers=None, url="", error=None, reason=""):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.url = url
+        self.error = error
+        self.reason = reason
+
+    @classmethod
+    def from_requests(cls, resp):
+        return cls(resp.status_code, resp.content, resp.headers, resp.url, reason=resp.reason)
+
+    @classmethod
+    def unavailable(cls, url, error):
+        return cls(503, b"", {}, url, error=error, reason="Service Unavailable")
+
+    @property
+    def ok(self):
+        return 200 <= self.status_code < 300
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        content_type = self.headers.get("Content-Type") or ""
+        if content_type.startswith(MSGPACK_MEDIA_TYPE):
+            return msgpack.unpackb(self.content, raw=False, strict_map_key=False)
+        if orjson is not None:
+            return orjson.loads(self.content)
+        return json.loads(self.content)
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("API circuit opened after %s failures", self._failures)
+                    metrics.incr("api.circuit_opened")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class Attempts:
+    # Retry, circuit-breaker and metrics bookkeeping for one API request. The
+    # sync and async clients share it and differ only in how a try is sent
+    # and how the pause before a retry is slept:
+    #
+    #     for delay in attempts:
+    #         sleep(delay)
+    #         started = time.perf_counter()
+    #         try: resp = send(...)
+    #         except <transport errors> as e: attempts.failed(started, e); continue
+    #         if attempts.received(started, resp): break
+    #     return attempts.result()
+
+    def __init__(self, client, method, path, timeout=None):
+        self.client = client
+        self.method = method.upper()
+        endpoint = client.endpoint_of(path)
+        self.url = client.base_url + path.lstrip("/")
+        self.metric = f"api.{self.method}.{endpoint}"
+        self.timeout = timeout or client.timeout_for(endpoint)
+        self.total = 1 + (client.max_retries if self.method in IDEMPOTENT_METHODS else 0)
+        self.last = None
+        self.rejected = False
+
+    def __iter__(self):
+        for attempt in range(self.total):
+            if not self.client.breaker.allow():
+                metrics.incr("api.circuit_rejected")
+                self.rejected = True
+                if self.last is None:
+                    self.last = ApiResponse.unavailable(self.url, CircuitOpen(self.url))
+                return
+            if attempt:
+                metrics.incr(f"{self.metric}.retries")
+                yield self.client.backoff_delay(attempt - 1)
+            else:
+                yield 0
+
+    def failed(self, started, error):
+        self._observe(started)
+        metrics.incr(f"{self.metric}.errors")
+        self.client.breaker.record_failure()
+        self.last = ApiResponse.unavailable(self.url, error)
+
+    def received(self, started, resp):
+        # True when `resp` is final, False when it is worth retrying
+        self._observe(started)
+        self.last = resp
+        if resp.status_code in RETRYABLE_STATUSES:
+            metrics.incr(f"{self.metric}.errors")
+            self.client.breaker.record_failure()
+            return False
+        self.client.breaker.record_success()
+        return True
+
+    def result(self):
+        if self.last.error is not None and not self.rejected:
+            logger.warning("API %s %s failed: %s", self.method, self.url, self.last.error)
+        return self.last
+
+    def _observe(self, started):
+        elapsed = time.perf_counter() - started
+        metrics.observe(self.metric, elapsed)
+        if elapsed >= SLOW_CALL_SECONDS:
+            logger.warning("Slow API call %s took %.2fs", self.url, elapsed)
+
+
+class BaseApiClient:
+    # configuration shared by ApiClient and aio.AsyncApiClient
+
+    def __init__(self, base_url, max_retries=2, backoff=0.2,
+                 timeouts=None, default_timeout=DEFAULT_TIMEOUT, breaker=None):
+        self.base_url = (base_url or "").rstrip("/") + "/"
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeouts = dict(ENDPOINT_TIMEOUTS, **(timeouts or {}))
+        self.default_timeout = default_timeout
+        self.breaker = breaker or CircuitBreaker()
+
+    @staticmethod
+    def endpoint_of(path):
+        return path.lstrip("/").split("/", 1)[0].split("?", 1)[0] or "root"
+
+    def timeout_for(self, endpoint):
+        return self.timeouts.get(endpoint, self.default_timeout)
+
+    def backoff_delay(self, attempt):
+        # full jitter, so retries from many workers don't line up
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def worst_case_seconds(self, path, method="GET"):
+        # how long request() can take before giving up: every try running
+        # into its timeouts plus the longest pauses between them
+        connect, read = self.timeout_for(self.endpoint_of(path))
+        retries = self.max_retries if method.upper() in IDEMPOTENT_METHODS else 0
+        return (retries + 1) * (connect + read) + sum(self.backoff * (2 ** a) for a in range(retries))
+
+
+class ApiClient(BaseApiClient):
+    def __init__(self, base_url, pool_size=20, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.session = requests.Session()
+        self.session.headers["Accept"] = ACCEPT
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, path, params=None, json=None, headers=None, timeout=None):
+        attempts = Attempts(self, method, path, timeout)
+        for delay in attempts:
+            if delay:
+                time.sleep(delay)
+            started = time.perf_counter()
+            try:
+                resp = self.session.request(
+                    attempts.method, attempts.url, params=params, json=json, headers=headers,
+                    timeout=attempts.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                attempts.failed(started, e)
+                continue
+            if attempts.received(started, ApiResponse.from_requests(resp)):
+                break
+        return attempts.result()
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request("PATCH", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def close(self):
+        self.session.close()
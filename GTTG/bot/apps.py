@@ -5,3 +5,6 @@ class BotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'GTTG.bot'
     verbose_name = 'Bot'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -1,5 +1,4 @@
 import os
-import requests
 import telebot
 from dotenv import load_dotenv
 from telebot import types
@@ -7,31 +6,147 @@ import redis
 import json
 from datetime import datetime  # added
 
+from .api_client import ApiClient
+from .catalog import Catalog
+from .callbacks import CallbackRouter
+from .catalog_cache import CATALOG_KEY, CatalogCache
+from .conversation import Conversation
+from .executor import ChatExecutor, update_chat_id
+from .fanout import Fanout
+from .metrics import metrics
+from .outbound import OutboundPipeline
+from .quick_entry import parse_sets
+from .session import SessionStore
+from .set_buffer import SetBuffer
+
 load_dotenv()
 
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 API_URL = os.getenv("API_URL")
+api = ApiClient(
+    API_URL,
+    pool_size=int(os.getenv("API_POOL_SIZE", 20)),
+    max_retries=int(os.getenv("API_MAX_RETRIES", 2)),
+)
+
+# independent calls within one handler run side by side (see fanout.py)
+fanout = Fanout(max_workers=int(os.getenv("BOT_FANOUT_WORKERS", 32)))
+
+
+def api_budget(path, method="GET"):
+    # how long to wait on a fanned-out API call: the client's own worst case,
+    # so the wait doesn't give up before the client does
+    return api.worst_case_seconds(path, method) + 1
 
 REDIS_URL = os.getenv("REDIS_URL")
 redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+# session hashes hold tagged binary values, so they get a non-decoding client
+session_redis = redis.Redis.from_url(REDIS_URL)
+
+# Handlers run inline in process_new_updates; runtimes hand updates to
+# dispatch(), which runs one chat's updates one at a time, in order
+bot = telebot.TeleBot(TOKEN, threaded=False)
+chats = ChatExecutor(
+    num_threads=int(os.getenv("BOT_WORKERS", 16)),
+    max_pending=int(os.getenv("BOT_MAX_PENDING_PER_CHAT", 20)),
+)
+
+
+def process_update(update):
+    with metrics.timer("bot.update"):
+        bot.process_new_updates([update])
+
+
+def dispatch(update):
+    return chats.submit(update_chat_id(update), process_update, update)
+
+# outgoing Bot API calls are rate limited and retried on flood waits (see outbound.py)
+OUTBOUND_PIPELINE = os.getenv("TELEGRAM_OUTBOUND_PIPELINE", "1") == "1"
+outbound = OutboundPipeline(
+    workers=int(os.getenv("TELEGRAM_SEND_WORKERS", 8)),
+    global_rate=float(os.getenv("TELEGRAM_GLOBAL_RATE", 30)),
+    chat_rate=float(os.getenv("TELEGRAM_CHAT_RATE", 1)),
+    chat_burst=int(os.getenv("TELEGRAM_CHAT_BURST", 3)),
+)
+if OUTBOUND_PIPELINE:
+    outbound.install(telebot.apihelper.CUSTOM_REQUEST_SENDER)
+
+
+def use_clients(api_client=None, redis=None, session_redis=None):
+    # Lets a runtime (see aio.py) swap in its own API / Redis clients
+    global api, redis_client
+    if api_client is not None:
+        api = api_client
+    if redis is not None:
+        redis_client = redis
+        set_buffer.client = redis
+    if session_redis is not None:
+        sessions.client = session_redis
 
-bot = telebot.TeleBot(TOKEN)
 
 # Redis utility functions
+sessions = SessionStore(
+    session_redis,
+    ttl=int(os.getenv("SESSION_TTL", 7 * 24 * 3600)),
+    max_bytes=int(os.getenv("SESSION_MAX_BYTES", 16 * 1024)),
+    compress_min=int(os.getenv("SESSION_COMPRESS_MIN_BYTES", 256)),
+)
+
+
 def get_user_data(user_id):
-    data = redis_client.get(f"user:{user_id}:data")
-    return json.loads(data) if data else {}
+    return sessions.get(user_id)
 
 
 def set_user_data(user_id, data):
-    redis_client.set(f"user:{user_id}:data", json.dumps(data))
+    sessions.save(user_id, data)
 
 
 def pop_user_data(user_id):
-    key = f"user:{user_id}:data"
-    data = redis_client.get(key)
-    redis_client.delete(key)
-    return json.loads(data) if data else {}
+    return sessions.pop(user_id)
+
+
+# Multi-step flows: the next expected message is a state in the session
+flow = Conversation(sessions)
+
+
+def session_too_large(session, fields):
+    # the update's largest changes weren't saved, so whatever flow was in
+    # progress can't rely on them: end it and say so
+    session.pop(flow.field, None)
+    bot.send_message(
+        session.user_id,
+        "⚠️ That was more than I can keep for an unfinished step, so the last change wasn't saved. "
+        "Please start this step again.",
+    )
+
+
+sessions.on_too_large = session_too_large
+
+# Inline buttons: callback_data is built with callbacks.data() and routed to
+# the handler registered for it (see callbacks.py)
+callbacks = CallbackRouter()
+
+
+# Logged sets: written straight to the API, or buffered in Redis and
+# flushed in batches when SET_WRITE_BEHIND=1
+def post_sets(workout_id, sets):
+    return api.post("workout-exercises/bulk/", json={"workout": int(workout_id), "sets": sets})
+
+
+set_buffer = SetBuffer(
+    redis_client,
+    post_sets,
+    max_batch=int(os.getenv("SET_BUFFER_MAX_BATCH", 20)),
+    max_age=int(os.getenv("SET_BUFFER_MAX_AGE", 30)),
+)
+WRITE_BEHIND = os.getenv("SET_WRITE_BEHIND", "0") == "1"
+
+
+def log_sets(workout_id, sets):
+    if WRITE_BEHIND:
+        set_buffer.append(workout_id, sets)
+        return True
+    return post_sets(workout_id, sets).status_code == 201
 
 
 # Caching
@@ -46,28 +161,63 @@ def cache_set(key, value, ttl=CACHE_TTL):
     redis_client.setex(key, ttl, json.dumps(value))
 
 
-def get_cached_muscle_groups():
-    key = "cache:muscle_groups"
-    data = cache_get(key)
-    if data is not None:
-        return data
-    resp = requests.get(f"{API_URL}muscle-groups/")
+catalog_cache = CatalogCache(REDIS_URL, ttl=CACHE_TTL)
+
+
+def _fetch_catalog():
+    # When the cached copy lapses, revalidate it: an unchanged catalog comes
+    # back as an empty 304 instead of the full list.
+    held = catalog_cache.peek(CATALOG_KEY)
+    headers = {"If-None-Match": held["etag"]} if held and held.get("etag") else None
+    resp = api.get("catalog/", headers=headers)
+    if resp.status_code == 304 and held:
+        metrics.incr("catalog.not_modified")
+        return held
     if resp.status_code == 200:
-        cache_set(key, resp.json())
-        return resp.json()
-    return []
+        data = resp.json()
+        data["etag"] = resp.headers.get("ETag")
+        return data
+    return None
+
+
+def get_cached_catalog():
+    return catalog_cache.get(CATALOG_KEY, _fetch_catalog) or {}
+
+
+def get_cached_muscle_groups():
+    return get_cached_catalog().get("muscle_groups", [])
 
 
 def get_cached_exercises():
-    key = "cache:exercises"
-    data = cache_get(key)
-    if data is not None:
-        return data
-    resp = requests.get(f"{API_URL}exercises/")
-    if resp.status_code == 200:
-        cache_set(key, resp.json())
-        return resp.json()
-    return []
+    return get_cached_catalog().get("exercises", [])
+
+
+_catalog = None
+
+
+def get_catalog():
+    # rebuilt only when the L1 cache hands out a new catalog version
+    global _catalog
+    groups = get_cached_muscle_groups()
+    exercises = get_cached_exercises()
+    catalog = _catalog
+    if catalog is None or not catalog.built_from(groups, exercises):
+        catalog = _catalog = Catalog(groups, exercises)
+    return catalog
+
+
+def find_exercise_by_name(catalog, name, exercise_ids):
+    # names aren't unique across muscle groups, so resolve within the offered ids
+    for ex in catalog.exercises_by_name.get(name, ()):
+        if ex.id in exercise_ids:
+            return ex
+    return None
+
+
+def plan_day_label(catalog, day_number, title, group_ids):
+    if title:
+        return f"Day {day_number}: {title}"
+    return f"Day {day_number}: " + ", ".join(catalog.group_name(gid) for gid in group_ids)
 
 
 # Pagination
@@ -84,14 +234,14 @@ def paginate_list(items, page, size):
 
 # Bot
 def get_or_create_user(telegram_id, username):
-    url = f"{API_URL}auth-user/"
-    response = requests.post(url, json={"telegram_id": telegram_id, "username": username})
+    response = api.post("auth-user/", json={"telegram_id": telegram_id, "username": username})
     if response.status_code == 200:
         return response.json()
     return None
 
 
 @bot.message_handler(commands=['start'])
+@sessions.scoped
 def handle_start(message):
     user = get_or_create_user(message.from_user.id, message.from_user.username or "")
     if user:
@@ -101,6 +251,7 @@ def handle_start(message):
 
 
 @bot.message_handler(commands=['help'])
+@sessions.scoped
 def handle_help(message):
     help_text = "/start - start GTTG" \
     "\n/help - show this" \
@@ -114,22 +265,25 @@ def handle_help(message):
 
 # Creating a training plan
 @bot.message_handler(commands=['createplan'])
+@sessions.scoped
 def start_create_plan(message):
     user_id = message.from_user.id
     set_user_data(user_id, {})
-    msg = bot.send_message(message.chat.id, "let's create a new training plan for You\nWhat's the name of the plan?")
-    bot.register_next_step_handler(msg, process_plan_name)
+    bot.send_message(message.chat.id, "let's create a new training plan for You\nWhat's the name of the plan?")
+    flow.goto(user_id, "plan_name")
 
 
+@flow.state("plan_name")
 def process_plan_name(message):
     user_id = message.from_user.id
     data = get_user_data(user_id)
     data['name'] = message.text.strip()
     set_user_data(user_id, data)
-    msg = bot.send_message(message.chat.id, "How long is Your training cycle going to be? (Days)")
-    bot.register_next_step_handler(msg, process_plan_length)
+    bot.send_message(message.chat.id, "How long is Your training cycle going to be? (Days)")
+    flow.goto(user_id, "plan_length")
 
 
+@flow.state("plan_length")
 def process_plan_length(message):
     user_id = message.from_user.id
     try:
@@ -143,8 +297,8 @@ def process_plan_length(message):
         set_user_data(user_id, data)
         ask_day_type(message)
     except ValueError:
-        msg = bot.send_message(message.chat.id, "Has to be a number.")
-        bot.register_next_step_handler(msg, process_plan_length)
+        bot.send_message(message.chat.id, "Has to be a number.")
+        flow.goto(user_id, "plan_length")
 
 
 def ask_day_type(message, user_id_override=None):
@@ -153,10 +307,11 @@ def ask_day_type(message, user_id_override=None):
     current_day = data['current_day']
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
     markup.add("Training", "Rest day")
-    msg = bot.send_message(message.chat.id, f"Day {current_day}: Training or Rest day?", reply_markup=markup)
-    bot.register_next_step_handler(msg, process_day_type)
+    bot.send_message(message.chat.id, f"Day {current_day}: Training or Rest day?", reply_markup=markup)
+    flow.goto(user_id, "day_type")
 
 
+@flow.state("day_type")
 def process_day_type(message):
     user_id = message.from_user.id
     text = message.text.lower().strip()
@@ -170,19 +325,18 @@ def process_day_type(message):
     current_day = data['current_day']
 
     if is_training:
-        groups = get_cached_muscle_groups()
+        groups = get_catalog().groups
         if groups:
-            data['available_groups'] = groups
-            data['selected_groups'] = []
+            data['selected_group_ids'] = []
             set_user_data(user_id, data)
 
             markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=False)
             for g in groups:
-                markup.add(g["name"])
+                markup.add(g.name)
             markup.add("✅ Done")
 
-            msg = bot.send_message(message.chat.id, f"Choose all muscle groups for day {current_day} then press '✅ Done':", reply_markup=markup)
-            bot.register_next_step_handler(msg, process_muscle_groups)
+            bot.send_message(message.chat.id, f"Choose all muscle groups for day {current_day} then press '✅ Done':", reply_markup=markup)
+            flow.goto(user_id, "day_muscle_groups")
         else:
             bot.send_message(message.chat.id, "Error while getting muscle groups.")
             ask_day_type(message)
@@ -196,49 +350,49 @@ def process_day_type(message):
         confirm_created_day(message)
 
 
+@flow.state("day_muscle_groups")
 def process_muscle_groups(message):
     user_id = message.from_user.id
     text = message.text.strip()
     data = get_user_data(user_id)
-    available = data.get("available_groups", [])
-    selected_list = data.get("selected_groups", [])
+    catalog = get_catalog()
+    selected_ids = data.get("selected_group_ids", [])
 
     if text == "✅ Done":
-        if not selected_list:
+        if not selected_ids:
             bot.send_message(message.chat.id, "Choose at least 1 muscle group.")
             return ask_day_type(message)
-        group_ids = [g["id"] for g in available if g["name"] in selected_list]
         current_day = data['current_day']
-        all_exercises = get_cached_exercises()
-        exercises_for_groups = [ex for ex in all_exercises if ex["muscle_group"]["id"] in group_ids]
+        exercises_for_groups = catalog.exercises_for_groups(selected_ids)
         if not exercises_for_groups:
             bot.send_message(message.chat.id, "No exercises found for selected muscle groups.")
             proceed_next_day(message)
             return
-        data['pending_exercises_for_day'] = exercises_for_groups
-        data['selected_exercises_for_day'] = []
+        data['pending_exercise_ids_for_day'] = [ex.id for ex in exercises_for_groups]
+        data['selected_exercise_ids_for_day'] = []
         data['exercise_selection_page'] = 0
         set_user_data(user_id, data)
         show_day_exercises_page(message, 0)
     else:
-        valid_names = [g["name"] for g in available]
-        if text not in valid_names:
+        group = catalog.group_by_name(text)
+        if group is None:
             bot.send_message(message.chat.id, "Choose from buttons below.")
         else:
-            if text not in selected_list:
-                selected_list.append(text)
-            data['selected_groups'] = selected_list
+            if group.id not in selected_ids:
+                selected_ids.append(group.id)
+            data['selected_group_ids'] = selected_ids
             set_user_data(user_id, data)
-        msg = bot.send_message(message.chat.id, "Choose more or press '✅ Done'")
-        bot.register_next_step_handler(msg, process_muscle_groups)
+        bot.send_message(message.chat.id, "Choose more or press '✅ Done'")
+        flow.goto(user_id, "day_muscle_groups")
 
 
+@flow.state("day_exercises")
 def process_exercises_for_day(message):
     user_id = message.from_user.id
     text = message.text.strip()
     data = get_user_data(user_id)
-    available_ex = data.get("pending_exercises_for_day", [])
-    selected_ex = data.get("selected_exercises_for_day", [])
+    available_ids = data.get("pending_exercise_ids_for_day", [])
+    selected_ids = data.get("selected_exercise_ids_for_day", [])
     page = data.get("exercise_selection_page", 0)
 
     if text.startswith("✔ "):
@@ -253,38 +407,39 @@ def process_exercises_for_day(message):
         return
 
     if text == "✅ Done":
-        if not selected_ex:
+        if not selected_ids:
             bot.send_message(message.chat.id, "Choose at least 1 exercise.")
             show_day_exercises_page(message, page)
             return
-        group_ids = [g["id"] for g in data.get("available_groups", []) if g["name"] in data.get("selected_groups",[])]
-        ex_ids = [ex["id"] for ex in available_ex if ex["name"] in selected_ex]
+        selected = set(selected_ids)
+        ex_ids = [ex_id for ex_id in available_ids if ex_id in selected]
         current_day = data['current_day']
         data['days'].append({
             "day_number": current_day,
             "is_training_day": True,
-            "muscle_groups": group_ids,
+            "muscle_groups": data.get("selected_group_ids", []),
             "default_exercises": ex_ids,
             "title": None
         })
-        data.pop('pending_exercises_for_day', None)
-        data.pop('selected_exercises_for_day', None)
+        data.pop('pending_exercise_ids_for_day', None)
+        data.pop('selected_exercise_ids_for_day', None)
         set_user_data(user_id, data)
         bot.send_message(message.chat.id, "Exercises chosen successfully ✅", reply_markup=types.ReplyKeyboardRemove())
-        msg = bot.send_message(message.chat.id, "Enter a title for this training day or send '-' to skip:")
-        bot.register_next_step_handler(msg, process_day_title)
+        bot.send_message(message.chat.id, "Enter a title for this training day or send '-' to skip:")
+        flow.goto(user_id, "day_title")
     else:
-        valid_names = [ex["name"] for ex in available_ex]
-        if text not in valid_names:
+        exercise = find_exercise_by_name(get_catalog(), text, set(available_ids))
+        if exercise is None:
             bot.send_message(message.chat.id, "Choose from buttons below.")
         else:
-            if text not in selected_ex:
-                selected_ex.append(text)
-            data['selected_exercises_for_day'] = selected_ex
+            if exercise.id not in selected_ids:
+                selected_ids.append(exercise.id)
+            data['selected_exercise_ids_for_day'] = selected_ids
             set_user_data(user_id, data)
         show_day_exercises_page(message, page)
 
 
+@flow.state("day_title")
 def process_day_title(message):
     user_id = message.from_user.id
     data = get_user_data(user_id)
@@ -304,9 +459,9 @@ def process_day_title(message):
 
 
 def _summarize_day_for_confirmation(day):
-    group_map = {g['id']: g['name'] for g in get_cached_muscle_groups()}
+    catalog = get_catalog()
     if day.get('is_training_day'):
-        groups = [group_map.get(gid, f"ID:{gid}") for gid in (day.get('muscle_groups') or [])]
+        groups = [catalog.group_name(gid) for gid in (day.get('muscle_groups') or [])]
         groups_part = ", ".join(groups) if groups else "—"
         title_part = f" ({day.get('title')})" if day.get('title') else ""
         ex_count = len(day.get('default_exercises') or [])
@@ -331,27 +486,29 @@ def confirm_created_day(message):
     summary = _summarize_day_for_confirmation(day_obj)
     markup = types.InlineKeyboardMarkup()
     markup.add(
-        types.InlineKeyboardButton("✅ Confirm", callback_data=f"confirm_day_{current_day}"),
-        types.InlineKeyboardButton("🗑️ Delete and redo", callback_data=f"delete_day_{current_day}")
+        types.InlineKeyboardButton("✅ Confirm", callback_data=callbacks.data("confirm_day", current_day)),
+        types.InlineKeyboardButton("🗑️ Delete and redo", callback_data=callbacks.data("delete_day", current_day))
     )
     bot.send_message(message.chat.id, f"Please confirm the day:\n\n{summary}", parse_mode="Markdown", reply_markup=markup)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("confirm_day_"))
-def handle_confirm_day(call):
+@callbacks.route("confirm_day", "c", int, legacy={"confirm_day_": None})
+@sessions.scoped
+def handle_confirm_day(call, day_number):
     user_id = call.from_user.id
+    data = get_user_data(user_id)
+    if data.get('current_day') != day_number:
+        # a button from an earlier day's message: confirming it would skip a day
+        bot.answer_callback_query(call.id, "This button is outdated.")
+        return
     bot.answer_callback_query(call.id, "Day confirmed ✅")
     proceed_next_day(call.message, user_id_override=user_id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("delete_day_"))
-def handle_delete_day(call):
+@callbacks.route("delete_day", "d", int, legacy={"delete_day_": None})
+@sessions.scoped
+def handle_delete_day(call, day_num):
     user_id = call.from_user.id
-    try:
-        day_num = int(call.data.split("delete_day_")[1])
-    except Exception:
-        bot.answer_callback_query(call.id)
-        return
     data = get_user_data(user_id)
     
     removed = False
@@ -387,78 +544,114 @@ def finalize_plan(message, user_id_override=None):
     cycle_payload = {
         "name": data['name'],
         "length": data['length'],
-        "telegram_id": user_id
+        "telegram_id": user_id,
+        "days": [
+            {
+                "day_number": day['day_number'],
+                "is_training_day": day['is_training_day'],
+                "muscle_groups": day['muscle_groups'],
+                "default_exercises": day.get('default_exercises') or [],
+                "title": day.get('title')
+            }
+            for day in data['days']
+        ]
     }
-    response = requests.post(f"{API_URL}training-cycles/", json=cycle_payload)
+    # one request, one transaction: no half-created plans
+    response = api.post("training-cycles/full/", json=cycle_payload)
     if response.status_code != 201:
         bot.send_message(message.chat.id, "Error while creating training cycle.")
         return
 
-    cycle_id = response.json()['id']
-    data['id'] = cycle_id
-    set_user_data(user_id, data)
-
-    for day in data['days']:
-        day_payload = {
-            "cycle": cycle_id,
-            "day_number": day['day_number'],
-            "is_training_day": day['is_training_day'],
-            "muscle_groups": day['muscle_groups'],
-            "title": day.get('title')
-        }
-        if day.get("default_exercises") is not None:
-            day_payload["default_exercises"] = day["default_exercises"]
-        requests.post(f"{API_URL}cycle-days/", json=day_payload)
+    plan = response.json()
 
     bot.send_message(message.chat.id, f"Plan created ✅", reply_markup=types.ReplyKeyboardRemove())
     
-    summary_text = generate_plan_summary(data)
+    summary_text = generate_plan_summary(plan, plan['days'])
     bot.send_message(message.chat.id, summary_text, parse_mode="Markdown")
 
     pop_user_data(user_id)
 
 
 # Listing plan summary
+# Rendered summaries and day keyboards are cached under the cycle's version,
+# which the API bumps on any change to the cycle or its days, plus the
+# catalog version for the group names in them.
+PLAN_CACHE_TTL = 24 * 3600
+
+
+def plan_cache_key(kind, plan_data):
+    version = plan_data.get("version")
+    if version is None:
+        return None
+    return f"plan:{plan_data['id']}:{version}:{catalog_cache.version or 0}:{kind}"
+
+
 def generate_plan_summary(plan_data, days_data=None):
+    # None when the days had to be fetched and couldn't be
     try:
-        group_map = {g['id']: g['name'] for g in get_cached_muscle_groups()}
-        summary = f"📝 *Here is your plan \"{plan_data['name']}\":*\n\n"
+        catalog = get_catalog()
+        key = plan_cache_key("summary", plan_data)
+        if key:
+            cached = redis_client.get(key)
+            if cached is not None:
+                metrics.incr("plan_cache.hit")
+                return cached
+            metrics.incr("plan_cache.miss")
 
         if days_data is None:
-            days_resp = requests.get(f"{API_URL}cycle-days/?cycle_id={plan_data['id']}")
+            days_resp = api.get("cycle-days/", params={"cycle_id": plan_data['id']})
             if days_resp.status_code != 200:
-                return "Error while getting cycle days."
+                return None
             days_data = days_resp.json()
 
-        seen = set()
-        unique_days = []
+        unique_days = {}
         for day in days_data:
-            key = (day['day_number'], day['is_training_day'], tuple(day['muscle_groups']))
-            if key not in seen:
-                seen.add(key)
-                unique_days.append(day)
-
-        unique_days.sort(key=lambda x: x['day_number'])
+            unique_days.setdefault((day['day_number'], day['is_training_day'], tuple(day['muscle_groups'])), day)
 
-        for day in unique_days:
+        parts = [f"📝 *Here is your plan \"{plan_data['name']}\":*\n\n"]
+        for day in sorted(unique_days.values(), key=lambda x: x['day_number']):
             title_part = f"{day.get('title')}" if day.get('title') else ""
-            summary += f"Day {day['day_number']}: *{title_part}* "
+            parts.append(f"Day {day['day_number']}: *{title_part}* ")
             if day['is_training_day']:
-                group_names = [group_map.get(gid, f"ID:{gid}") for gid in day['muscle_groups']]
-                summary += f"\nMuscle groups: *{', '.join(group_names)}*\n"
+                group_names = [catalog.group_name(gid) for gid in day['muscle_groups']]
+                parts.append(f"\nMuscle groups: *{', '.join(group_names)}*\n")
             else:
-                summary += "Rest day 😴\n"
-            summary += "\n"
+                parts.append("Rest day 😴\n")
+            parts.append("\n")
 
-        return summary.strip()
+        summary = "".join(parts).strip()
+        if key:
+            redis_client.setex(key, PLAN_CACHE_TTL, summary)
+        return summary
     except Exception as e:
         return f"Error generating plan summary: {str(e)}"
 
 
+def plan_day_choices(plan_data):
+    # (keyboard labels, compact session rows) for the plan's training days
+    catalog = get_catalog()
+    key = plan_cache_key("days", plan_data)
+    cached = cache_get(key) if key else None
+    if cached is not None:
+        return cached["labels"], cached["rows"]
+    labels = []
+    # compact rows: [day_number, cycle_day_id, title, group_ids, exercise_ids]
+    rows = []
+    for d in plan_data["days"]:
+        if not d["is_training_day"]:
+            continue
+        labels.append(plan_day_label(catalog, d['day_number'], d.get('title'), d['muscle_groups']))
+        rows.append([d['day_number'], d['id'], d.get('title'), d['muscle_groups'], d.get('default_exercises') or []])
+    if key:
+        cache_set(key, {"labels": labels, "rows": rows}, PLAN_CACHE_TTL)
+    return labels, rows
+
+
 @bot.message_handler(commands=['myplans'])
+@sessions.scoped
 def list_user_plans(message):
     user_id = message.from_user.id
-    response = requests.get(f"{API_URL}training-cycles/?telegram_id={user_id}")
+    response = api.get("training-cycles/", params={"telegram_id": user_id, "fields": "id,name"})
     
     if response.status_code != 200 or not response.json():
         bot.send_message(message.chat.id, "You have no saved plans.")
@@ -470,82 +663,70 @@ def list_user_plans(message):
     for plan in plans:
         btn = types.InlineKeyboardButton(
             text=plan['name'],
-            callback_data=f"view_plan_{plan['id']}"
+            callback_data=callbacks.data("view_plan", plan['id'])
         )
         markup.add(btn)
     
     bot.send_message(message.chat.id, "⭐ Your current plan: /currentplan\n📋 All Your training plans:", reply_markup=markup)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("view_plan_"))
-def handle_view_plan(call):
-    plan_id = call.data.split("view_plan_")[1]
+@callbacks.route("view_plan", "v", int, legacy={"view_plan_": None})
+@sessions.scoped
+def handle_view_plan(call, plan_id):
 
-    plan_resp = requests.get(f"{API_URL}training-cycles/{plan_id}/")
+    plan_resp = api.get(f"training-cycles/{plan_id}/")
     if plan_resp.status_code != 200:
         bot.answer_callback_query(call.id, "Plan not found.")
         return
 
     plan = plan_resp.json()
 
-    days_resp = requests.get(f"{API_URL}cycle-days/?cycle_id={plan_id}")
-    if days_resp.status_code != 200:
+    # the days are only fetched when the summary isn't cached for this version
+    summary = generate_plan_summary(plan)
+    if summary is None:
         bot.answer_callback_query(call.id, "Failed to get days.")
         return
-
-    days = days_resp.json()
-
-    summary = generate_plan_summary(plan, days)
     markup = types.InlineKeyboardMarkup()
     markup.add(
-        types.InlineKeyboardButton("🗑️ Delete", callback_data=f"delete_plan_confirm_{plan_id}"),
-        types.InlineKeyboardButton("⭐ Set as current", callback_data=f"set_current_plan_{plan_id}")
+        types.InlineKeyboardButton("🗑️ Delete", callback_data=callbacks.data("confirm_delete_plan", plan_id)),
+        types.InlineKeyboardButton("⭐ Set as current", callback_data=callbacks.data("set_current_plan", plan_id))
     )
     bot.send_message(call.message.chat.id, summary, parse_mode="Markdown", reply_markup=markup)
     bot.answer_callback_query(call.id)
 
 
+def get_current_plan(telegram_id):
+    # 404 when the user has no current plan
+    return api.get(f"users/{telegram_id}/current-plan/")
+
+
 @bot.message_handler(commands=['currentplan'])
+@sessions.scoped
 def handle_current_plan(message):
     user_id = message.from_user.id
 
-    user_resp = requests.get(f"{API_URL}users/{user_id}/")
-    if user_resp.status_code != 200:
-        bot.send_message(message.chat.id, "❌ Failed to fetch user info.")
-        return
-
-    user_data = user_resp.json()
-    current_cycle = user_data.get("current_cycle")
-
-    if not current_cycle:
+    plan_resp = get_current_plan(user_id)
+    if plan_resp.status_code == 404:
         bot.send_message(message.chat.id, "⚠️ You don't have a current plan set.")
         return
-
-    plan_resp = requests.get(f"{API_URL}training-cycles/{current_cycle}/")
     if plan_resp.status_code != 200:
         bot.send_message(message.chat.id, "❌ Failed to fetch your current plan.")
         return
 
     plan_data = plan_resp.json()
-
-    days_resp = requests.get(f"{API_URL}cycle-days/?cycle_id={current_cycle}")
-    if days_resp.status_code != 200:
-        bot.send_message(message.chat.id, "❌ Failed to fetch plan days.")
-        return
-
-    days = days_resp.json()
+    days = plan_data["days"]
 
     summary = generate_plan_summary(plan_data, days)
     bot.send_message(message.chat.id, f"⭐ *Your current plan:*\n\n{summary}", parse_mode="Markdown")
 
 
 # Setting training plan as current
-@bot.callback_query_handler(func=lambda call: call.data.startswith("set_current_plan_"))
-def handle_set_current_plan(call):
-    plan_id = call.data.split("set_current_plan_")[1]
+@callbacks.route("set_current_plan", "s", int, legacy={"set_current_plan_": None})
+@sessions.scoped
+def handle_set_current_plan(call, plan_id):
     user_id = call.from_user.id
 
-    response = requests.patch(f"{API_URL}users/{user_id}/", json={"current_cycle": plan_id})
+    response = api.patch(f"users/{user_id}/", json={"current_cycle": plan_id})
     if response.status_code == 200:
         bot.send_message(call.message.chat.id, "⭐ This plan was set as current!")
     else:
@@ -554,16 +735,16 @@ def handle_set_current_plan(call):
 
 
 # Deleting training plan
-@bot.callback_query_handler(func=lambda call: call.data.startswith("delete_plan_confirm_"))
-def confirm_delete_plan(call):
-    plan_id = call.data.split("delete_plan_confirm_")[1]
+@callbacks.route("confirm_delete_plan", "x", int, legacy={"delete_plan_confirm_": None})
+@sessions.scoped
+def confirm_delete_plan(call, plan_id):
     user_id = call.from_user.id
     data = get_user_data(user_id)
 
     markup = types.InlineKeyboardMarkup()
     markup.add(
-        types.InlineKeyboardButton("🗑️ Yes, delete", callback_data=f"delete_plan_{plan_id}"),
-        types.InlineKeyboardButton("❌ No, cancel", callback_data="cancel_delete")
+        types.InlineKeyboardButton("🗑️ Yes, delete", callback_data=callbacks.data("delete_plan", plan_id)),
+        types.InlineKeyboardButton("❌ No, cancel", callback_data=callbacks.data("cancel_delete"))
     )
     sent = bot.send_message(call.message.chat.id, "Are You sure You want to delete this training plan?", reply_markup=markup)
     bot.answer_callback_query(call.id)
@@ -572,13 +753,13 @@ def confirm_delete_plan(call):
     set_user_data(user_id, data)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("delete_plan_"))
-def handle_delete_plan(call):
-    plan_id = call.data.split("delete_plan_")[1]
+@callbacks.route("delete_plan", "X", int, legacy={"delete_plan_": None})
+@sessions.scoped
+def handle_delete_plan(call, plan_id):
     user_id = call.from_user.id
     data = get_user_data(user_id)
     last_del_conf_msg_id = data.get('delete_plan_confirmation_msg_id')
-    response = requests.delete(f"{API_URL}training-cycles/{plan_id}/")
+    response = api.delete(f"training-cycles/{plan_id}/")
     
     if last_del_conf_msg_id: 
         if response.status_code == 204:
@@ -601,7 +782,8 @@ def handle_delete_plan(call):
     bot.answer_callback_query(call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "cancel_delete")
+@callbacks.route("cancel_delete", "n", legacy={"cancel_delete": ()})
+@sessions.scoped
 def cancel_delete(call):
     user_id = call.from_user.id
     data = get_user_data(user_id)
@@ -622,133 +804,112 @@ def cancel_delete(call):
 
 # Starting workout
 @bot.message_handler(commands=['startworkout'])
+@sessions.scoped
 def start_workout(message):
     user_id = message.from_user.id
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
     markup.add("From my plan", "Custom workout")
-    msg = bot.send_message(message.chat.id, "Do you want to start workout from your current plan or create a custom one?", reply_markup=markup)
-    bot.register_next_step_handler(msg, process_workout_type)
+    bot.send_message(message.chat.id, "Do you want to start workout from your current plan or create a custom one?", reply_markup=markup)
+    flow.goto(user_id, "workout_type")
 
 
+@flow.state("workout_type")
 def process_workout_type(message):
     user_id = message.from_user.id
     text = message.text.strip().lower()
 
     if text == "from my plan":
-        user_resp = requests.get(f"{API_URL}users/{user_id}/")
-        if user_resp.status_code != 200:
-            bot.send_message(message.chat.id, "❌ Failed to fetch your user info.", reply_markup=types.ReplyKeyboardRemove())
-            return
-        user_data = user_resp.json()
-        current_cycle = user_data.get("current_cycle")
-        if not current_cycle:
+        plan_resp = get_current_plan(user_id)
+        if plan_resp.status_code == 404:
             bot.send_message(message.chat.id, "⚠️ You don't have a current plan set.", reply_markup=types.ReplyKeyboardRemove())
             return
-
-        days_resp = requests.get(f"{API_URL}cycle-days/?cycle_id={current_cycle}")
-        if days_resp.status_code != 200:
+        if plan_resp.status_code != 200:
             bot.send_message(message.chat.id, "❌ Failed to fetch plan days.", reply_markup=types.ReplyKeyboardRemove())
             return
 
-        days = days_resp.json()
-        training_days = [d for d in days if d["is_training_day"]]
-
-        if not training_days:
+        labels, plan_days = plan_day_choices(plan_resp.json())
+        if not plan_days:
             bot.send_message(message.chat.id, "⚠️ Your plan has no training days.", reply_markup=types.ReplyKeyboardRemove())
             return
 
-        group_map = {g['id']: g['name'] for g in get_cached_muscle_groups()}
-
         data = get_user_data(user_id)
-        data["training_days"] = training_days
-        day_number_to_label = {}
-        day_number_to_day = {}
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-        for d in training_days:
-            group_names = [group_map.get(gid, f"ID:{gid}") for gid in d['muscle_groups']]
-            if d.get('title'):
-                day_label = f"Day {d['day_number']}: {d['title']}"
-            else:
-                day_label = f"Day {d['day_number']}: " + ", ".join(group_names)
-            markup.add(day_label)
-            day_number_to_label[d['day_number']] = day_label
-            day_number_to_day[d['day_number']] = d
-        data["day_number_to_label"] = day_number_to_label
-        data["day_number_to_day"] = day_number_to_day
+        for label in labels:
+            markup.add(label)
+        data["plan_days"] = plan_days
         set_user_data(user_id, data)
-        msg = bot.send_message(message.chat.id, "Choose day to start workout:", reply_markup=markup)
-        bot.register_next_step_handler(msg, process_select_plan_day)
+        bot.send_message(message.chat.id, "Choose day to start workout:", reply_markup=markup)
+        flow.goto(user_id, "workout_plan_day")
 
     elif text == "custom workout":
-        groups = get_cached_muscle_groups()
+        groups = get_catalog().groups
         if not groups:
             bot.send_message(message.chat.id, "Error while fetching muscle groups.", reply_markup=types.ReplyKeyboardRemove())
             return
         data = get_user_data(user_id)
-        data["available_groups"] = groups
-        data["selected_groups"] = []
+        data["selected_group_ids"] = []
         set_user_data(user_id, data)
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=False)
         for g in groups:
-            markup.add(g["name"])
+            markup.add(g.name)
         markup.add("✅ Done")
-        msg = bot.send_message(message.chat.id, "Choose muscle groups for your workout, then press '✅ Done':", reply_markup=markup)
-        bot.register_next_step_handler(msg, process_custom_muscle_groups)
+        bot.send_message(message.chat.id, "Choose muscle groups for your workout, then press '✅ Done':", reply_markup=markup)
+        flow.goto(user_id, "workout_muscle_groups")
 
     else:
         bot.send_message(message.chat.id, "Choose button from below.")
         start_workout(message)
 
 
+@flow.state("workout_plan_day")
 def process_select_plan_day(message):
     user_id = message.from_user.id
     text = message.text.strip()
     data = get_user_data(user_id)
-    day_number_to_label = data.get("day_number_to_label", {})
-    day_number_to_day = data.get("day_number_to_day", {})
+    catalog = get_catalog()
+    plan_days = data.get("plan_days", [])
+    labels = [plan_day_label(catalog, number, title, group_ids) for number, _, title, group_ids, _ in plan_days]
 
-    selected_day_number = None
-    for num, label in day_number_to_label.items():
+    selected_day = None
+    for label, day in zip(labels, plan_days):
         if label == text:
-            selected_day_number = num
+            selected_day = day
             break
 
-    selected_day = day_number_to_day.get(selected_day_number)
-
     if not selected_day:
         bot.send_message(message.chat.id, "Choose day from the buttons below.")
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-        for label in day_number_to_label.values():
+        for label in labels:
             markup.add(label)
-        msg = bot.send_message(message.chat.id, "Choose day to start workout:", reply_markup=markup)
-        bot.register_next_step_handler(msg, process_select_plan_day)
+        bot.send_message(message.chat.id, "Choose day to start workout:", reply_markup=markup)
+        flow.goto(user_id, "workout_plan_day")
         return
 
+    day_number, cycle_day_id, _, group_ids, default_ex_ids = selected_day
     workout_payload = {
         "telegram_id": user_id,
         "is_from_plan": True,
-        "muscle_groups": selected_day["muscle_groups"],
-        "cycle_day_id": selected_day.get("id")
+        "muscle_groups": group_ids,
+        "cycle_day_id": cycle_day_id
     }
-    resp = requests.post(f"{API_URL}workouts/", json=workout_payload)
+    resp = api.post("workouts/", json=workout_payload)
 
     if resp.status_code == 201:
         workout = resp.json()
-        bot.send_message(message.chat.id, f"Workout started from your plan (Day {selected_day['day_number']}) ✅", reply_markup=types.ReplyKeyboardRemove())
+        bot.send_message(message.chat.id, f"Workout started from your plan (Day {day_number}) ✅", reply_markup=types.ReplyKeyboardRemove())
 
         data = get_user_data(user_id)
+        data.pop('plan_days', None)
         data['current_workout_id'] = workout['id']
         set_user_data(user_id, data)
 
-        default_ex_ids = selected_day.get("default_exercises", [])
-        all_exercises = get_cached_exercises()
-        workout_exercises = [ex for ex in all_exercises if ex["id"] in default_ex_ids]
+        workout_exercises = catalog.exercises_by_ids(default_ex_ids)
 
         if not workout_exercises:
             bot.send_message(message.chat.id, "⚠️ No exercises found for this day.")
             return
 
-        data['pending_exercises'] = workout_exercises
+        data['pending_exercise_ids'] = [ex.id for ex in workout_exercises]
         data['exercise_index'] = 0
         data['exercise_choice_page'] = 0
         set_user_data(user_id, data)
@@ -760,27 +921,27 @@ def process_select_plan_day(message):
         pop_user_data(user_id)
 
 
+@flow.state("workout_muscle_groups")
 def process_custom_muscle_groups(message):
     user_id = message.from_user.id
     text = message.text.strip()
     data = get_user_data(user_id)
-    available = data.get("available_groups", [])
-    selected_list = data.get("selected_groups", [])
+    catalog = get_catalog()
+    group_ids = data.get("selected_group_ids", [])
 
     if text == "✅ Done":
-        if not selected_list:
+        if not group_ids:
             bot.send_message(message.chat.id, "Choose at least 1 muscle group.")
-            msg = bot.send_message(message.chat.id, "Choose muscle groups for your workout, then press '✅ Done':")
-            bot.register_next_step_handler(msg, process_custom_muscle_groups)
+            bot.send_message(message.chat.id, "Choose muscle groups for your workout, then press '✅ Done':")
+            flow.goto(user_id, "workout_muscle_groups")
             return
 
-        group_ids = [g["id"] for g in available if g["name"] in selected_list]
         workout_payload = {
             "telegram_id": user_id,
             "is_from_plan": False,
             "muscle_groups": group_ids
         }
-        resp = requests.post(f"{API_URL}workouts/", json=workout_payload)
+        resp = api.post("workouts/", json=workout_payload)
 
         if resp.status_code == 201:
             workout = resp.json()
@@ -790,14 +951,13 @@ def process_custom_muscle_groups(message):
             data['current_workout_id'] = workout['id']
             set_user_data(user_id, data)
 
-            all_exercises = get_cached_exercises()
-            workout_exercises = [ex for ex in all_exercises if ex["muscle_group"]["id"] in group_ids]
+            workout_exercises = catalog.exercises_for_groups(group_ids)
 
             if not workout_exercises:
                 bot.send_message(message.chat.id, "⚠️ No exercises found for selected groups.")
                 return
 
-            data['pending_exercises'] = workout_exercises
+            data['pending_exercise_ids'] = [ex.id for ex in workout_exercises]
             data['exercise_index'] = 0
             data['exercise_choice_page'] = 0
             set_user_data(user_id, data)
@@ -809,32 +969,35 @@ def process_custom_muscle_groups(message):
             pop_user_data(user_id)
 
     else:
-        valid_names = [g["name"] for g in available]
-        if text not in valid_names:
+        group = catalog.group_by_name(text)
+        if group is None:
             bot.send_message(message.chat.id, "Choose from buttons below.")
         else:
-            if text not in selected_list:
-                selected_list.append(text)
-            data['selected_groups'] = selected_list
+            if group.id not in group_ids:
+                group_ids.append(group.id)
+            data['selected_group_ids'] = group_ids
             set_user_data(user_id, data)
-        msg = bot.send_message(message.chat.id, "Choose more or press '✅ Done'")
-        bot.register_next_step_handler(msg, process_custom_muscle_groups)
+        bot.send_message(message.chat.id, "Choose more or press '✅ Done'")
+        flow.goto(user_id, "workout_muscle_groups")
 
 
 def show_day_exercises_page(message, page=0):
     user_id = message.from_user.id
     data = get_user_data(user_id)
-    all_ex = data.get('pending_exercises_for_day', [])
-    current_selected = data.get('selected_exercises_for_day', [])
-    page_slice, page, total_pages = paginate_list(all_ex, page, EXERCISES_PAGE_SIZE)
+    catalog = get_catalog()
+    all_ids = data.get('pending_exercise_ids_for_day', [])
+    current_selected = set(data.get('selected_exercise_ids_for_day', []))
+    page_slice, page, total_pages = paginate_list(all_ids, page, EXERCISES_PAGE_SIZE)
 
     data['exercise_selection_page'] = page
     set_user_data(user_id, data)
 
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=False)
-    for ex in page_slice:
-        name = ex["name"]
-        display = f"✔ {name}" if name in current_selected else name
+    for ex_id in page_slice:
+        exercise = catalog.exercise(ex_id)
+        if exercise is None:
+            continue
+        display = f"✔ {exercise.name}" if ex_id in current_selected else exercise.name
         markup.add(display)
     nav_row = []
     if total_pages > 1 and page > 0:
@@ -844,42 +1007,45 @@ def show_day_exercises_page(message, page=0):
     if nav_row:
         markup.add(*nav_row)
     markup.add("✅ Done")
-    msg = bot.send_message(
+    bot.send_message(
         message.chat.id,
         f"Choose exercises (page {page+1}/{total_pages}), then '✅ Done':",
         reply_markup=markup
     )
 
-    bot.register_next_step_handler(msg, process_exercises_for_day)
+    flow.goto(user_id, "day_exercises")
 
 
 def build_exercise_choice_markup(user_id):
     data = get_user_data(user_id)
-    exercises = data.get("pending_exercises", [])
+    catalog = get_catalog()
+    exercise_ids = data.get("pending_exercise_ids", [])
     page = data.get("exercise_choice_page", 0)
-    slice_items, page, total_pages = paginate_list(exercises, page, EXERCISES_PAGE_SIZE)
+    slice_items, page, total_pages = paginate_list(exercise_ids, page, EXERCISES_PAGE_SIZE)
     data['exercise_choice_page'] = page
     set_user_data(user_id, data)
 
     markup = types.InlineKeyboardMarkup()
-    for ex in slice_items:
-        markup.add(types.InlineKeyboardButton(text=ex["name"], callback_data=f"ex_choice_{ex['id']}"))
+    for ex_id in slice_items:
+        exercise = catalog.exercise(ex_id)
+        if exercise is not None:
+            markup.add(types.InlineKeyboardButton(text=exercise.name, callback_data=callbacks.data("ex_choice", ex_id)))
 
     last_set = data.get('last_set') or {}
     current_workout_id = data.get('current_workout_id')
     can_repeat = bool(last_set) and last_set.get('workout_id') == current_workout_id
     if can_repeat:
         weight_display = trim_zeros(last_set.get('weight'))
-        markup.add(types.InlineKeyboardButton(f"🔁 Repeat {weight_display}kg", callback_data="repeat_set"))
+        markup.add(types.InlineKeyboardButton(f"🔁 Repeat {weight_display}kg", callback_data=callbacks.data("repeat_set")))
 
     nav_buttons = []
     if total_pages > 1 and page > 0:
-        nav_buttons.append(types.InlineKeyboardButton("⬅️ Prev", callback_data="ex_page_prev"))
+        nav_buttons.append(types.InlineKeyboardButton("⬅️ Prev", callback_data=callbacks.data("ex_page", -1)))
     if total_pages > 1 and page < total_pages - 1:
-        nav_buttons.append(types.InlineKeyboardButton("➡️ Next", callback_data="ex_page_next"))
+        nav_buttons.append(types.InlineKeyboardButton("➡️ Next", callback_data=callbacks.data("ex_page", 1)))
     if nav_buttons:
         markup.add(*nav_buttons)
-    markup.add(types.InlineKeyboardButton("✅ Finish workout", callback_data="finish_workout"))
+    markup.add(types.InlineKeyboardButton("✅ Finish workout", callback_data=callbacks.data("finish_workout")))
     return markup, page, total_pages
 
 
@@ -895,15 +1061,12 @@ def show_exercise_choices(message):
     set_user_data(user_id, data)
 
 
-@bot.callback_query_handler(func=lambda call: call.data in ["ex_page_prev", "ex_page_next"])
-def paginate_exercise_choices(call):
+@callbacks.route("ex_page", "ep", int, legacy={"ex_page_prev": (-1,), "ex_page_next": (1,)})
+@sessions.scoped
+def paginate_exercise_choices(call, step):
     user_id = call.from_user.id
     data = get_user_data(user_id)
-    page = data.get("exercise_choice_page", 0)
-    if call.data == "ex_page_prev":
-        page -= 1
-    else:
-        page += 1
+    page = data.get("exercise_choice_page", 0) + step
     data['exercise_choice_page'] = page
     set_user_data(user_id, data)
     markup, page, total_pages = build_exercise_choice_markup(user_id)
@@ -921,16 +1084,16 @@ def paginate_exercise_choices(call):
     bot.answer_callback_query(call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("ex_choice_"))
-def process_exercise_choice(call):
+@callbacks.route("ex_choice", "e", int, legacy={"ex_choice_": None})
+@sessions.scoped
+def process_exercise_choice(call, exercise_id):
     user_id = call.from_user.id
-    exercise_id = int(call.data.split("ex_choice_")[1])
     data = get_user_data(user_id)
     data['current_exercise_id'] = exercise_id
     set_user_data(user_id, data)
 
-    exercise = next((ex for ex in data.get("pending_exercises", []) if ex["id"] == exercise_id), None)
-    exercise_name = exercise["name"] if exercise else "Exercise"
+    exercise = get_catalog().exercise(exercise_id)
+    exercise_name = exercise.name if exercise else "Exercise"
 
     last_msg_id = data.get('last_exercise_choice_msg_id')
     if last_msg_id:
@@ -945,46 +1108,71 @@ def process_exercise_choice(call):
             pass
 
     bot.answer_callback_query(call.id)
-    bot.send_message(call.message.chat.id, "Enter weight for the set (kg):")
-    bot.register_next_step_handler(call.message, process_set_weight)
+    bot.send_message(call.message.chat.id, "Enter weight for the set (kg):\n(or several sets at once: 80x5x3 or 80x5, 85x5, 90x3)")
+    flow.goto(user_id, "set_weight")
 
 
+@flow.state("set_weight")
 def process_set_weight(message):
     user_id = message.from_user.id
     try:
         weight = float(message.text.strip())
     except ValueError:
-        bot.send_message(message.chat.id, "❌ Please enter a valid weight (number).")
-        bot.register_next_step_handler(message, process_set_weight)
+        quick_sets = parse_sets(message.text)
+        if quick_sets:
+            return log_quick_sets(message, quick_sets)
+        bot.send_message(message.chat.id, "❌ Please enter a valid weight (number) or sets like 80x5x3.")
+        flow.goto(user_id, "set_weight")
         return
 
     data = get_user_data(user_id)
     data["current_weight"] = weight
     set_user_data(user_id, data)
     bot.send_message(message.chat.id, "Enter number of reps:")
-    bot.register_next_step_handler(message, process_set_reps)
+    flow.goto(user_id, "set_reps")
+
 
+def log_quick_sets(message, quick_sets):
+    # several sets from one message, stored with a single batched write
+    user_id = message.from_user.id
+    data = get_user_data(user_id)
+    exercise_id = data.get("current_exercise_id")
+    sets = [{"exercise": exercise_id, "reps": reps, "weight": weight} for weight, reps in quick_sets]
+
+    if not log_sets(data.get("current_workout_id"), sets):
+        bot.send_message(message.chat.id, "❌ Failed to log sets. Try again.")
+        flow.goto(user_id, "set_weight")
+        return
 
+    data['last_set'] = {
+        'workout_id': data.get('current_workout_id'),
+        'exercise_id': exercise_id,
+        'weight': quick_sets[-1][0]
+    }
+    set_user_data(user_id, data)
+    logged = ", ".join(f"{trim_zeros(weight)}x{reps}" for weight, reps in quick_sets)
+    bot.send_message(message.chat.id, f"✅ {len(sets)} sets logged: {logged}")
+    show_exercise_choices(message)
+
+
+@flow.state("set_reps")
 def process_set_reps(message):
     user_id = message.from_user.id
     try:
         reps = int(message.text.strip())
     except ValueError:
         bot.send_message(message.chat.id, "❌ Please enter a valid number of reps.")
-        bot.register_next_step_handler(message, process_set_reps)
+        flow.goto(user_id, "set_reps")
         return
 
     data = get_user_data(user_id)
-    payload = {
-        "workout": data.get("current_workout_id"),
+    workout_set = {
         "exercise": data.get("current_exercise_id"),
         "reps": reps,
         "weight": data.get("current_weight")
     }
 
-    resp = requests.post(f"{API_URL}workout-exercises/", json=payload)
-
-    if resp.status_code == 201:
+    if log_sets(data.get("current_workout_id"), [workout_set]):
         data['last_set'] = {
             'workout_id': data.get('current_workout_id'),
             'exercise_id': data.get('current_exercise_id'),
@@ -996,10 +1184,11 @@ def process_set_reps(message):
         show_exercise_choices(message)
     else:
         bot.send_message(message.chat.id, "❌ Failed to log set. Try again.")
-        bot.register_next_step_handler(message, process_set_weight)
+        flow.goto(user_id, "set_weight")
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "repeat_set")
+@callbacks.route("repeat_set", "r", legacy={"repeat_set": ()})
+@sessions.scoped
 def handle_repeat_set(call):
     user_id = call.from_user.id
     data = get_user_data(user_id)
@@ -1009,8 +1198,8 @@ def handle_repeat_set(call):
         bot.answer_callback_query(call.id, "No previous set to repeat.")
         return
 
-    exercise = next((ex for ex in data.get("pending_exercises", []) if ex["id"] == last["exercise_id"]), None)
-    exercise_name = exercise["name"] if exercise else "Exercise"
+    exercise = get_catalog().exercise(last["exercise_id"])
+    exercise_name = exercise.name if exercise else "Exercise"
 
     last_weight = last.get('weight', 0)
     data['current_exercise_id'] = last['exercise_id']
@@ -1030,32 +1219,49 @@ def handle_repeat_set(call):
             pass
 
     bot.answer_callback_query(call.id)
-    msg = bot.send_message(call.message.chat.id, "Enter number of reps:")
-    bot.register_next_step_handler(msg, process_set_reps)
+    bot.send_message(call.message.chat.id, "Enter number of reps:")
+    flow.goto(user_id, "set_reps")
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "finish_workout")
+@callbacks.route("finish_workout", "f", legacy={"finish_workout": ()})
+@sessions.scoped
 def finish_workout(call):
     user_id = call.from_user.id
     data = get_user_data(user_id)
     last_msg_id = data.get('last_exercise_choice_msg_id')
     current_workout_id = data.get('current_workout_id')
-    if last_msg_id:
-        try:
-            bot.delete_message(call.message.chat.id, last_msg_id)
-        except Exception:
-            pass
+
+    def delete_choice_message():
+        if last_msg_id:
+            try:
+                bot.delete_message(call.message.chat.id, last_msg_id)
+            except Exception:
+                pass
+
+    def load_workout():
+        # buffered sets go in first so the summary includes them
+        synced = not WRITE_BEHIND or set_buffer.flush(current_workout_id, wait=3)
+        return synced, api.get(f"workouts/{current_workout_id}/", params=WORKOUT_SUMMARY_PARAMS)
 
     if current_workout_id:
         try:
-            resp = requests.get(f"{API_URL}workouts/{current_workout_id}/")
-            if resp.status_code == 200:
-                workout = resp.json()
-                bot.send_message(call.message.chat.id, "🏁 Workout completed! Well done 💪", reply_markup=types.ReplyKeyboardRemove())
-                summary = format_workout_summary(workout)
-                bot.send_message(call.message.chat.id, summary)
+            timeout = api_budget("workouts/")
+            if WRITE_BEHIND:
+                timeout += 3 + api_budget("workout-exercises/bulk/", "POST")
+            _, (synced, resp) = fanout.gather(delete_choice_message, load_workout, timeout=timeout)
         except Exception:
-            bot.send_message(call.message.chat.id, "🏁 Workout completed! Well done 💪", reply_markup=types.ReplyKeyboardRemove())
+            synced, resp = True, None
+        if not synced:
+            # stays buffered; the flush timer retries
+            bot.send_message(call.message.chat.id, "⚠️ Some sets are still syncing and may be missing below.")
+        bot.send_message(call.message.chat.id, "🏁 Workout completed! Well done 💪", reply_markup=types.ReplyKeyboardRemove())
+        if resp is not None and resp.status_code == 200:
+            try:
+                bot.send_message(call.message.chat.id, format_workout_summary(resp.json()))
+            except Exception:
+                pass
+    else:
+        delete_choice_message()
 
     pop_user_data(user_id)
 
@@ -1079,11 +1285,6 @@ def get_set_volume(workout_set):
     return (workout_set.get("weight") or 0) * (workout_set.get("reps") or 0)
 
 
-def build_group_map():
-    groups = get_cached_muscle_groups()
-    return {g["id"]: g["name"] for g in groups}
-
-
 def get_group_names_from_workout(workout):
     names = []
     if isinstance(workout.get("muscle_groups"), list) and workout["muscle_groups"]:
@@ -1115,27 +1316,11 @@ def format_date_dmy(date_str):
         return date_str
 
 
-def build_history_item_label(workout, group_map):
-    date_str = workout.get("date") or ""
-    is_from_plan = workout.get("is_from_plan", True)
-    title = None
-    cycle_day = workout.get("cycle_day") or {}
-    if is_from_plan and isinstance(cycle_day, dict):
-        title = (cycle_day.get("title") or "").strip() or None
-
-    if title:
-        label_core = title
-    else:
-        names = get_group_names_from_workout(workout)
-        if not names:
-            ids = workout.get("muscle_groups") or []
-            if ids and isinstance(ids[0], int):
-                names = [group_map.get(i, f"ID:{i}") for i in ids]
-        label_core = ", ".join(names) if names else "No groups"
-
-    suffix = "" if is_from_plan else " (custom)"
-    display_date = format_date_dmy(date_str) if date_str else ""
-    return f"{display_date} - {label_core}{suffix}"
+# just what format_workout_summary reads; the API skips the rest, joins included
+WORKOUT_SUMMARY_PARAMS = {
+    "fields": "date,is_from_plan,total_volume,cycle_day.title,muscle_groups.name,exercises.reps,exercises.weight,"
+              "exercises.exercise.name,exercises.exercise.muscle_group.name",
+}
 
 
 def format_workout_summary(workout):
@@ -1178,90 +1363,120 @@ def format_workout_summary(workout):
     return "\n".join(lines)
 
 
-def get_user_workouts(telegram_id):
-    try:
-        resp = requests.get(f"{API_URL}workouts/?telegram_id={telegram_id}")
-        if resp.status_code != 200:
-            return []
-        items = resp.json()
-        items.sort(key=lambda w: (w.get("date") or "", w.get("id") or 0), reverse=True)
-        return items
-    except Exception:
-        return []
-
+def get_history_page(telegram_id, after=None, before=None):
+    params = {"telegram_id": telegram_id, "limit": HISTORY_PAGE_SIZE}
+    if after:
+        params["after"] = after
+    elif before:
+        params["before"] = before
+    resp = api.get("workouts/history/", params=params)
+    if resp.status_code != 200:
+        return {"results": [], "next": None, "previous": None}
+    return resp.json()
 
-def build_history_markup(user_id, page=0):
-    workouts = get_user_workouts(user_id)
-    group_map = build_group_map()
-    items, page, total_pages = paginate_list(workouts, page, HISTORY_PAGE_SIZE)
 
+def build_history_markup(history):
     markup = types.InlineKeyboardMarkup()
-    for w in items:
-        label = build_history_item_label(w, group_map)
+    for w in history["results"]:
+        label = w["label"]
         if len(label) > 64:
             label = label[:61] + "..."
-        markup.add(types.InlineKeyboardButton(text=label, callback_data=f"hist_open_{w['id']}"))
+        markup.add(types.InlineKeyboardButton(text=label, callback_data=callbacks.data("hist_open", w['id'])))
 
     nav = []
-    if total_pages > 1 and page > 0:
-        nav.append(types.InlineKeyboardButton("⬅️ Prev", callback_data="hist_prev"))
-    if total_pages > 1 and page < total_pages - 1:
-        nav.append(types.InlineKeyboardButton("➡️ Next", callback_data="hist_next"))
+    if history["previous"]:
+        nav.append(types.InlineKeyboardButton("⬅️ Prev", callback_data=callbacks.data("hist_page", -1)))
+    if history["next"]:
+        nav.append(types.InlineKeyboardButton("➡️ Next", callback_data=callbacks.data("hist_page", 1)))
     if nav:
         markup.add(*nav)
-    return markup, page, total_pages
+    return markup
+
+
+def remember_history_page(data, history, page):
+    # cursors of the page on screen; prev/next taps continue from them
+    data['history_page'] = page
+    data['history_cursors'] = [history["previous"], history["next"]]
 
 
 @bot.message_handler(commands=['history'])
+@sessions.scoped
 def handle_history(message):
     user_id = message.from_user.id
+    # the API call overlaps the session read
+    page = fanout.submit(lambda: get_history_page(user_id))
     data = get_user_data(user_id)
-    data['history_page'] = 0
+    try:
+        history = page.result(timeout=api_budget("workouts/history/"))
+    except Exception:
+        bot.send_message(message.chat.id, "❌ Failed to load your workouts.")
+        return
+    remember_history_page(data, history, 0)
     set_user_data(user_id, data)
 
-    markup, page, total_pages = build_history_markup(user_id, 0)
-    sent = bot.send_message(message.chat.id, f"📜 Your workouts (page {page+1}/{total_pages}):", reply_markup=markup)
+    markup = build_history_markup(history)
+    sent = bot.send_message(message.chat.id, "📜 Your workouts (page 1):", reply_markup=markup)
     data['last_history_msg_id'] = sent.message_id
     set_user_data(user_id, data)
 
 
-@bot.callback_query_handler(func=lambda call: call.data in ["hist_prev", "hist_next"])
-def paginate_history(call):
+@callbacks.route("hist_page", "hp", int, legacy={"hist_prev": (-1,), "hist_next": (1,)})
+@sessions.scoped
+def paginate_history(call, step):
     user_id = call.from_user.id
     data = get_user_data(user_id)
     page = data.get('history_page', 0)
-    if call.data == "hist_prev":
-        page -= 1
+    previous_cursor, next_cursor = data.get('history_cursors') or [None, None]
+    if step < 0 and previous_cursor:
+        cursor = {"before": previous_cursor}
+    elif step > 0 and next_cursor:
+        cursor = {"after": next_cursor}
     else:
+        cursor = {}
+    # the button spinner stops while the page loads; a failed answer (e.g.
+    # the query is too old) doesn't keep the page from rendering
+    history, _ = fanout.gather(
+        lambda: get_history_page(user_id, **cursor),
+        lambda: bot.answer_callback_query(call.id),
+        timeout=api_budget("workouts/history/"),
+        return_exceptions=True,
+    )
+    if isinstance(history, Exception):
+        bot.send_message(call.message.chat.id, "❌ Failed to load your workouts.")
+        return
+    if "before" in cursor:
+        page = max(0, page - 1) if history["previous"] else 0
+    elif "after" in cursor:
         page += 1
-    data['history_page'] = page
+    else:
+        page = 0
+    remember_history_page(data, history, page)
     set_user_data(user_id, data)
 
-    markup, page, total_pages = build_history_markup(user_id, page)
+    markup = build_history_markup(history)
     last_id = data.get('last_history_msg_id')
     try:
         if last_id:
             bot.edit_message_text(
                 chat_id=call.message.chat.id,
                 message_id=last_id,
-                text=f"📜 Your workouts (page {page+1}/{total_pages}):",
+                text=f"📜 Your workouts (page {page+1}):",
                 reply_markup=markup
             )
         else:
-            sent = bot.send_message(call.message.chat.id, f"📜 Your workouts (page {page+1}/{total_pages}):", reply_markup=markup)
+            sent = bot.send_message(call.message.chat.id, f"📜 Your workouts (page {page+1}):", reply_markup=markup)
             data['last_history_msg_id'] = sent.message_id
             set_user_data(user_id, data)
     except Exception:
         pass
-    bot.answer_callback_query(call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("hist_open_"))
-def handle_open_history(call):
+@callbacks.route("hist_open", "h", int, legacy={"hist_open_": None})
+@sessions.scoped
+def handle_open_history(call, workout_id):
     user_id = call.from_user.id
-    workout_id = call.data.split("hist_open_")[1]
     try:
-        resp = requests.get(f"{API_URL}workouts/{workout_id}/")
+        resp = api.get(f"workouts/{workout_id}/", params=WORKOUT_SUMMARY_PARAMS)
         if resp.status_code != 200:
             bot.answer_callback_query(call.id, "Failed to load workout.")
             return
@@ -1273,6 +1488,20 @@ def handle_open_history(call):
         bot.answer_callback_query(call.id)
 
 
+@bot.callback_query_handler(func=lambda call: True)
+def handle_callback(call):
+    if not callbacks.dispatch(call):
+        # a button from an older layout, or data we never produced
+        bot.answer_callback_query(call.id)
+
+
+# Registered last so commands and other handlers take precedence
+@bot.message_handler(func=lambda message: True)
+@sessions.scoped
+def handle_flow_step(message):
+    flow.dispatch(message)
+
+
 if __name__ == '__main__':
-    print("Bot polling...")
-    bot.infinity_polling(skip_pending=True)
+    from .worker import main
+    main(["--runtime", "sync"])
@@ -0,0 +1,153 @@
+import logging
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# callback_data layout: <version><opcode>[:<arg>:<arg>...], e.g. "1v:1c"
+# for view_plan(48). Ints are base36, strings go as they are. Bump VERSION
+# when an opcode's arguments change meaning: buttons left in old messages
+# then stop matching instead of reaching the wrong handler.
+VERSION = "1"
+SEP = ":"
+MAX_BYTES = 64  # Telegram's limit on callback_data
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+_MATCH = "\0"
+
+
+def _encode_int(value):
+    if value < 0:
+        return "-" + _encode_int(-value)
+    out = ""
+    while True:
+        value, digit = divmod(value, 36)
+        out = _DIGITS[digit] + out
+        if not value:
+            return out
+
+
+def _encode(kind, value):
+    if kind is int:
+        return _encode_int(int(value))
+    value = str(value)
+    if SEP in value:
+        raise ValueError(f"{value!r} contains {SEP!r}")
+    return value
+
+
+def _decode(kind, raw, base):
+    return int(raw, base) if kind is int else raw
+
+
+class _Route:
+    __slots__ = ("name", "handler", "types", "args", "base")
+
+    def __init__(self, name, handler, types, args=None, base=36):
+        self.name = name
+        self.handler = handler
+        self.types = types
+        self.args = args  # fixed arguments of an exact legacy alias
+        self.base = base
+
+    def parse(self, rest):
+        if self.args is not None:
+            return self.args
+        raw = rest.split(SEP) if rest else []
+        if len(raw) != len(self.types):
+            raise ValueError(f"{self.name} takes {len(self.types)} arguments, got {len(raw)}")
+        return tuple(_decode(kind, value, self.base) for kind, value in zip(self.types, raw))
+
+
+class CallbackRouter:
+    # Inline-button routing. Every route is a key in one character trie and a
+    # lookup walks callback_data once, taking the longest registered prefix,
+    # so overlapping legacy prefixes ("delete_plan_", "delete_plan_confirm_")
+    # no longer depend on registration order. Handlers get typed arguments.
+
+    def __init__(self, version=VERSION):
+        self.version = version
+        self._trie = {}
+        self._routes = {}  # name -> (opcode, types)
+
+    def route(self, name, opcode, *types, legacy=None):
+        # `legacy` keeps buttons in messages sent before the router working:
+        # {"view_plan_": None} parses the rest of the data (decimal) as the
+        # arguments, {"hist_prev": (-1,)} is an exact alias with fixed ones.
+        def decorator(func):
+            if name in self._routes:
+                raise ValueError(f"Callback route {name!r} is already registered")
+            if SEP in opcode or opcode[:1].isdigit():
+                raise ValueError(f"Bad opcode {opcode!r}")
+            self._routes[name] = (opcode, types)
+            key = self.version + opcode
+            if types:
+                self._insert(key + SEP, _Route(name, func, types), exact=False)
+            else:
+                self._insert(key, _Route(name, func, types), exact=True)
+            for data, args in (legacy or {}).items():
+                if args is None:
+                    self._insert(data, _Route(name, func, types, base=10), exact=False)
+                else:
+                    self._insert(data, _Route(name, func, types, args=tuple(args)), exact=True)
+            return func
+        return decorator
+
+    def _insert(self, key, route, exact):
+        node = self._trie
+        for char in key:
+            node = node.setdefault(char, {})
+        slot = "exact" if exact else "prefix"
+        entries = node.setdefault(_MATCH, {})
+        if slot in entries:
+            raise ValueError(f"Callback data {key!r} is already routed to {entries[slot].name!r}")
+        entries[slot] = route
+
+    def data(self, name, *args):
+        opcode, types = self._routes[name]
+        if len(args) != len(types):
+            raise TypeError(f"{name} takes {len(types)} arguments, got {len(args)}")
+        data = self.version + opcode
+        if types:
+            data += SEP + SEP.join(_encode(kind, value) for kind, value in zip(types, args))
+        if len(data.encode()) > MAX_BYTES:
+            raise ValueError(f"callback_data for {name} is over {MAX_BYTES} bytes: {data!r}")
+        return data
+
+    def match(self, data):
+        # (route, arguments), or None
+        node = self._trie
+        found = None
+        for position, char in enumerate(data):
+            entries = node.get(_MATCH)
+            if entries and "prefix" in entries:
+                found = (entries["prefix"], position)
+            node = node.get(char)
+            if node is None:
+                break
+        else:
+            entries = node.get(_MATCH, {})
+            if "exact" in entries:
+                return entries["exact"], entries["exact"].parse("")
+            if "prefix" in entries:
+                found = (entries["prefix"], len(data))
+        if found is None:
+            return None
+        route, position = found
+        try:
+            return route, route.parse(data[position:])
+        except ValueError:
+            return None
+
+    def dispatch(self, call):
+        # False when nothing handles the data; the caller still has to
+        # answer the query so the button stops spinning
+        matched = self.match(call.data or "")
+        if matched is None:
+            logger.info("Unrouted callback data %r", call.data)
+            metrics.incr("callback.unrouted")
+            return False
+        route, args = matched
+        metrics.incr(f"callback.{route.name}")
+        route.handler(call, *args)
+        return True
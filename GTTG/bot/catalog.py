@@ -0,0 +1,94 @@
+class MuscleGroupRecord:
+    __slots__ = ("id", "name", "_dict")
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self._dict = None
+
+    def as_dict(self):
+        if self._dict is None:
+            self._dict = {"id": self.id, "name": self.name}
+        return self._dict
+
+
+class ExerciseRecord:
+    __slots__ = ("id", "name", "muscle_group", "position", "_dict")
+
+    def __init__(self, id, name, muscle_group, position):
+        self.id = id
+        self.name = name
+        self.muscle_group = muscle_group
+        self.position = position
+        self._dict = None
+
+    @property
+    def muscle_group_id(self):
+        return self.muscle_group.id if self.muscle_group else None
+
+    def as_dict(self):
+        # same shape as the API's ExerciseSerializer
+        if self._dict is None:
+            self._dict = {
+                "id": self.id,
+                "name": self.name,
+                "muscle_group": self.muscle_group.as_dict() if self.muscle_group else None,
+            }
+        return self._dict
+
+
+class Catalog:
+    # Built once per catalog version from the cached API payloads; read-only afterwards.
+
+    def __init__(self, muscle_groups, exercises):
+        self._sources = (muscle_groups, exercises)
+
+        self.groups = tuple(MuscleGroupRecord(g["id"], g["name"]) for g in muscle_groups)
+        self.groups_by_id = {g.id: g for g in self.groups}
+        self.groups_by_name = {g.name: g for g in self.groups}
+        self.group_names = {g.id: g.name for g in self.groups}
+
+        records = []
+        for position, ex in enumerate(exercises):
+            group = ex.get("muscle_group") or {}
+            record_group = self.groups_by_id.get(group.get("id"))
+            if record_group is None and group.get("id") is not None:
+                record_group = MuscleGroupRecord(group["id"], group.get("name"))
+            records.append(ExerciseRecord(ex["id"], ex["name"], record_group, position))
+        self.exercises = tuple(records)
+        self.exercises_by_id = {ex.id: ex for ex in self.exercises}
+
+        by_group = {}
+        by_name = {}
+        for ex in self.exercises:
+            by_group.setdefault(ex.muscle_group_id, []).append(ex)
+            by_name.setdefault(ex.name, []).append(ex)
+        self.exercises_by_group = {gid: tuple(items) for gid, items in by_group.items()}
+        self.exercises_by_name = {name: tuple(items) for name, items in by_name.items()}
+
+    def built_from(self, muscle_groups, exercises):
+        return self._sources[0] is muscle_groups and self._sources[1] is exercises
+
+    def group(self, group_id):
+        return self.groups_by_id.get(group_id)
+
+    def group_by_name(self, name):
+        return self.groups_by_name.get(name)
+
+    def group_name(self, group_id):
+        return self.group_names.get(group_id, f"ID:{group_id}")
+
+    def exercise(self, exercise_id):
+        return self.exercises_by_id.get(exercise_id)
+
+    def exercises_for_groups(self, group_ids):
+        found = []
+        for gid in set(group_ids):
+            found.extend(self.exercises_by_group.get(gid, ()))
+        found.sort(key=lambda ex: ex.position)
+        return found
+
+    def exercises_by_ids(self, exercise_ids):
+        found = [self.exercises_by_id[i] for i in set(exercise_ids) if i in self.exercises_by_id]
+        found.sort(key=lambda ex: ex.position)
+        return found
@@ -0,0 +1,119 @@
+import json
+import logging
+import threading
+import time
+
+import redis
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# the /catalog/ payload (muscle groups + exercises) plus its ETag
+CATALOG_KEY = "cache:catalog"
+CATALOG_KEYS = (CATALOG_KEY,)
+CATALOG_VERSION_KEY = "cache:catalog_version"
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+
+def publish_catalog_change(client):
+    # Called by the web app whenever the catalog changes in the DB
+    pipe = client.pipeline()
+    pipe.incr(CATALOG_VERSION_KEY)
+    pipe.delete(*CATALOG_KEYS)
+    version = pipe.execute()[0]
+    client.publish(INVALIDATION_CHANNEL, version)
+    return version
+
+
+class CatalogCache:
+    # L1: parsed values in process memory, stamped with the catalog version.
+    # L2: the shared Redis cache:* keys. Invalidations arrive over pub/sub.
+
+    def __init__(self, redis_url, ttl=3600, max_age=None):
+        self.client = redis.Redis.from_url(redis_url, decode_responses=True)
+        self.ttl = ttl
+        # bounds staleness if pub/sub messages are ever missed
+        self.max_age = max_age or ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._version = None
+        self._listener = None
+
+    @property
+    def version(self):
+        return self._version
+
+    def get(self, key, loader):
+        self._ensure_listener()
+        entry = self._fresh(key)
+        if entry is not None:
+            metrics.incr("catalog.l1_hit")
+            return entry[2]
+
+        with self._lock:
+            # whoever held the lock before us may have just loaded it
+            entry = self._fresh(key)
+            if entry is not None:
+                metrics.incr("catalog.l1_wait")
+                return entry[2]
+            version = self._version
+            value = self._load(key, loader)
+            if value is not None:
+                self._entries[key] = (version, time.monotonic(), value)
+            return value
+
+    def _fresh(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == self._version and time.monotonic() - entry[1] < self.max_age:
+            return entry
+        return None
+
+    def peek(self, key):
+        # last value held for the key, however old; for revalidating it
+        entry = self._entries.get(key)
+        return entry[2] if entry is not None else None
+
+    def _load(self, key, loader):
+        raw = self.client.get(key)
+        if raw is not None:
+            metrics.incr("catalog.l2_hit")
+            return json.loads(raw)
+        metrics.incr("catalog.miss")
+        value = loader()
+        if value is not None:
+            self.client.setex(key, self.ttl, json.dumps(value))
+        return value
+
+    def invalidate(self, version=None):
+        with self._lock:
+            self._entries.clear()
+            self._version = version
+        metrics.incr("catalog.invalidated")
+
+    def _ensure_listener(self):
+        if self._listener is not None:
+            return
+        with self._lock:
+            if self._listener is None:
+                self._version = self.client.get(CATALOG_VERSION_KEY)
+                self._listener = threading.Thread(target=self._listen, name="catalog-invalidation", daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                # anything published while we were disconnected is lost, so resync
+                current = self.client.get(CATALOG_VERSION_KEY)
+                if current != self._version:
+                    self.invalidate(current)
+                for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.invalidate(message["data"])
+            except redis.RedisError as e:
+                logger.warning("Catalog invalidation listener disconnected: %s", e)
+                time.sleep(5)
+            finally:
+                pubsub.close()
@@ -0,0 +1,61 @@
+import logging
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+STATE_FIELD = "state"
+
+
+class Conversation:
+    # Next-step routing for multi-message flows. The current state id lives in
+    # the user's session hash (see session.py) instead of TeleBot's in-memory
+    # next-step handlers, so any worker can take the user's next message and a
+    # restart doesn't drop in-progress flows.
+
+    def __init__(self, sessions, field=STATE_FIELD):
+        self.sessions = sessions
+        self.field = field
+        self._handlers = {}
+
+    def state(self, name):
+        # Registers the handler for messages received while in `name`
+        def decorator(func):
+            if name in self._handlers:
+                raise ValueError(f"Conversation state {name!r} is already registered")
+            self._handlers[name] = func
+            return func
+        return decorator
+
+    @property
+    def states(self):
+        return tuple(self._handlers)
+
+    def goto(self, user_id, name):
+        if name not in self._handlers:
+            raise KeyError(f"Unknown conversation state {name!r}")
+        self.sessions.get(user_id)[self.field] = name
+
+    def current(self, user_id):
+        return self.sessions.get(user_id).get(self.field)
+
+    def finish(self, user_id):
+        self.sessions.get(user_id).pop(self.field, None)
+
+    def dispatch(self, message):
+        # Must run inside a sessions.scoped handler. Like a next-step handler,
+        # a state is consumed by the message; handlers goto() again to stay.
+        user_id = message.from_user.id
+        name = self.current(user_id)
+        if name is None:
+            return False
+        self.finish(user_id)
+        handler = self._handlers.get(name)
+        if handler is None:
+            # stored by a different deployment; the flow has to be restarted
+            logger.warning("Dropping unknown conversation state %r for user %s", name, user_id)
+            metrics.incr("conversation.unknown_state")
+            return False
+        metrics.incr(f"conversation.step.{name}")
+        handler(message)
+        return True
@@ -0,0 +1,111 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_PENDING_PER_CHAT = 20
+
+
+def update_chat_id(update):
+    # same keys as streams.chat_id_of, on a parsed telebot Update
+    query = update.callback_query
+    if query is not None:
+        if query.message is not None:
+            return query.message.chat.id
+        return query.from_user.id
+    for message in (update.message, update.edited_message):
+        if message is not None:
+            return message.chat.id
+    return None
+
+
+class ChatExecutor:
+    # The dispatch layer the polling, async and webhook runtimes hand updates
+    # to (the stream consumer gets the same guarantee from its partitions).
+    # Tasks for one chat run one at a time in arrival order; different chats
+    # run in parallel on the pool. A chat with work is scheduled once in
+    # `ready`; after each task it goes to the back of the line, so one busy
+    # chat can't starve the others.
+
+    def __init__(self, num_threads=16, max_pending=MAX_PENDING_PER_CHAT):
+        self.num_threads = num_threads
+        self.max_pending = max_pending
+        self.ready = queue.Queue()
+        self._chats = {}  # chat id -> deque of pending tasks, present while the chat has work
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._running = True
+        self._workers = []
+
+    def submit(self, key, func, *args, **kwargs):
+        # False when the chat already has max_pending tasks queued and this
+        # one is dropped
+        if key is None:
+            key = object()  # nothing to order against
+        with self._lock:
+            self._start()
+            tasks = self._chats.get(key)
+            if tasks is None:
+                tasks = self._chats[key] = deque()
+                self.ready.put(key)
+            elif len(tasks) >= self.max_pending:
+                metrics.incr("executor.dropped")
+                logger.warning("Dropping update for chat %s: %s tasks already queued", key, len(tasks))
+                return False
+            tasks.append((func, args, kwargs, time.perf_counter()))
+            self._pending += 1
+            metrics.record("executor.chat_depth", len(tasks))
+            metrics.gauge("executor.pending", self._pending)
+            metrics.gauge("executor.active_chats", len(self._chats))
+        return True
+
+    def start(self, num_threads=None):
+        # the pool size is fixed once the threads are running
+        with self._lock:
+            if num_threads is not None and not self._workers:
+                self.num_threads = num_threads
+            self._start()
+
+    def _start(self):
+        # threads start on first use: runtimes that run updates inline never need them
+        if self._workers:
+            return
+        for i in range(self.num_threads):
+            worker = threading.Thread(target=self._work, name=f"chat-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        while self._running:
+            try:
+                key = self.ready.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                func, args, kwargs, enqueued = self._chats[key].popleft()
+                self._pending -= 1
+            metrics.observe("executor.wait", time.perf_counter() - enqueued)
+            try:
+                with metrics.timer("executor.task"):
+                    func(*args, **kwargs)
+            except Exception:
+                metrics.incr("executor.errors")
+                logger.exception("Update handler failed for chat %s", key)
+            with self._lock:
+                if self._chats[key]:
+                    self.ready.put(key)
+                else:
+                    del self._chats[key]
+                metrics.gauge("executor.pending", self._pending)
+                metrics.gauge("executor.active_chats", len(self._chats))
+
+    def close(self):
+        self._running = False
+        for worker in self._workers:
+            if worker is not threading.current_thread():
+                worker.join()
@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class FanoutTimeout(Exception):
+    pass
+
+
+class Fanout:
+    # Runs a handler's independent blocking calls (API, Redis, Telegram) side
+    # by side and joins them, so the handler waits for the slowest call rather
+    # than the sum. Calls must not touch the per-thread session scope: read
+    # and write session data on the handler's own thread.
+
+    def __init__(self, max_workers=32):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fanout")
+        self._local = threading.local()
+
+    def gather(self, *calls, timeout=None, return_exceptions=False):
+        # Results in call order. `timeout` is shared by all calls. When one
+        # call raises (or the timeout passes), calls that haven't started are
+        # cancelled and the error is raised; running ones finish in the
+        # background and their results are dropped. With return_exceptions
+        # errors are returned in place instead.
+        if getattr(self._local, "inside", False):
+            # already on a pool thread: waiting on the pool could deadlock it
+            return [self._call_inline(call, return_exceptions) for call in calls]
+
+        started = time.perf_counter()
+        futures = [self._pool.submit(self._run, call) for call in calls]
+        done, pending = wait(
+            futures, timeout=timeout, return_when=ALL_COMPLETED if return_exceptions else FIRST_EXCEPTION,
+        )
+        metrics.observe("fanout.gather", time.perf_counter() - started)
+
+        for future in pending:
+            future.cancel()
+        failure = next((f.exception() for f in futures if f in done and f.exception() is not None), None)
+        timed_out = None
+        if pending and (failure is None or return_exceptions):
+            metrics.incr("fanout.timeout")
+            timed_out = FanoutTimeout(f"{len(pending)} of {len(futures)} calls unfinished after {timeout}s")
+
+        if not return_exceptions:
+            if failure is not None:
+                raise failure
+            if timed_out is not None:
+                raise timed_out
+            return [future.result() for future in futures]
+        return [
+            timed_out if future in pending
+            else future.exception() if future.exception() is not None
+            else future.result()
+            for future in futures
+        ]
+
+    def submit(self, call):
+        # for overlapping one call with work that has to stay on the handler
+        # thread (session reads); returns a Future
+        if getattr(self._local, "inside", False):
+            future = Future()
+            try:
+                future.set_result(call())
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self._pool.submit(self._run, call)
+
+    def _run(self, call):
+        self._local.inside = True
+        try:
+            return call()
+        finally:
+            self._local.inside = False
+
+    @staticmethod
+    def _call_inline(call, return_exceptions):
+        try:
+            return call()
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return e
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
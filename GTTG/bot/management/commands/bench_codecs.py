@@ -0,0 +1,69 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from GTTG.bot import renderers
+from GTTG.bot.models import User
+from GTTG.bot.views import ExerciseViewSet, MuscleGroupViewSet, WorkoutViewSet
+
+
+class Command(BaseCommand):
+    help = "Compare encode/decode time and payload size of the API codecs on real endpoint data."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--telegram-id", type=int, help="User for the workout endpoints. Defaults to the one with most workouts.")
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def handle(self, *args, **options):
+        telegram_id = options["telegram_id"]
+        if telegram_id is None:
+            user = User.objects.annotate(n=Count("workouts")).order_by("-n").first()
+            if user is None:
+                raise CommandError("No users to benchmark with; pass --telegram-id.")
+            telegram_id = user.telegram_id
+
+        endpoints = [
+            ("muscle-groups/", MuscleGroupViewSet.as_view({"get": "list"}), {}),
+            ("exercises/", ExerciseViewSet.as_view({"get": "list"}), {}),
+            ("workouts/", WorkoutViewSet.as_view({"get": "list"}), {"telegram_id": telegram_id}),
+            ("workouts/history/", WorkoutViewSet.as_view({"get": "history"}), {"telegram_id": telegram_id, "limit": 100}),
+        ]
+
+        # (name, encode, decode)
+        codecs = [("json", JSONRenderer().render, json.loads)]
+        if renderers.orjson is not None:
+            codecs.append(("orjson", renderers.ORJSONRenderer().render, renderers.orjson.loads))
+        else:
+            self.stdout.write(self.style.WARNING("orjson is not installed; skipping it."))
+        if renderers.msgpack is not None:
+            codecs.append((
+                "msgpack", renderers.MessagePackRenderer().render,
+                lambda raw: renderers.msgpack.unpackb(raw, raw=False, strict_map_key=False),
+            ))
+        else:
+            self.stdout.write(self.style.WARNING("msgpack is not installed; skipping it."))
+
+        factory = APIRequestFactory()
+        repeat = options["repeat"]
+        self.stdout.write(f"{'endpoint':<20}{'codec':<10}{'bytes':>10}{'encode ms':>12}{'decode ms':>12}")
+        for path, view, params in endpoints:
+            response = view(factory.get("/api/" + path, params))
+            if response.status_code != 200:
+                self.stdout.write(self.style.WARNING(f"{path}: HTTP {response.status_code}, skipped"))
+                continue
+            data = response.data
+            for name, encode, decode in codecs:
+                raw = encode(data)
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    encode(data)
+                encode_ms = (time.perf_counter() - started) * 1000 / repeat
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    decode(raw)
+                decode_ms = (time.perf_counter() - started) * 1000 / repeat
+                self.stdout.write(f"{path:<20}{name:<10}{len(raw):>10}{encode_ms:>12.3f}{decode_ms:>12.3f}")
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+
+class Command(BaseCommand):
+    help = "Register, unregister or inspect the Telegram webhook (served at /telegram/webhook/)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["set", "delete", "info"])
+        parser.add_argument("--url", help="Public webhook URL. Defaults to TELEGRAM_WEBHOOK_URL.")
+        parser.add_argument("--drop-pending", action="store_true", help="Drop updates queued while switching.")
+        parser.add_argument("--max-connections", type=int, default=40)
+
+    def handle(self, *args, **options):
+        if not settings.TELEGRAM_BOT_TOKEN:
+            raise CommandError("TELEGRAM_BOT_TOKEN is not set.")
+
+        import telebot
+        bot = telebot.TeleBot(settings.TELEGRAM_BOT_TOKEN, threaded=False)
+        action = options["action"]
+
+        if action == "set":
+            url = options["url"] or settings.TELEGRAM_WEBHOOK_URL
+            if not url:
+                raise CommandError("Pass --url or set TELEGRAM_WEBHOOK_URL.")
+            if not settings.TELEGRAM_WEBHOOK_SECRET:
+                raise CommandError("TELEGRAM_WEBHOOK_SECRET is not set.")
+            bot.set_webhook(
+                url=url,
+                secret_token=settings.TELEGRAM_WEBHOOK_SECRET,
+                allowed_updates=ALLOWED_UPDATES,
+                max_connections=options["max_connections"],
+                drop_pending_updates=options["drop_pending"],
+            )
+            self.stdout.write(self.style.SUCCESS(f"Webhook set to {url}. Stop the polling worker."))
+        elif action == "delete":
+            bot.delete_webhook(drop_pending_updates=options["drop_pending"])
+            self.stdout.write(self.style.SUCCESS("Webhook removed. Updates can be long-polled again."))
+        else:
+            info = bot.get_webhook_info()
+            self.stdout.write(f"url: {info.url or '-'}")
+            self.stdout.write(f"pending_update_count: {info.pending_update_count}")
+            if info.last_error_message:
+                self.stdout.write(self.style.WARNING(f"last_error: {info.last_error_message}"))
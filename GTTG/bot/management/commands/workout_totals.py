@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from GTTG.bot.models import Workout, WorkoutExercise
+
+
+class Command(BaseCommand):
+    help = "Verify the stored Workout totals (total_volume, set_count, exercise_count) or recompute them. Migration 0014 backfills them once."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true", help="Only report workouts whose stored totals are off.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        verify = options["verify"]
+        batch_size = options["batch_size"]
+        checked = mismatched = 0
+        last_id = 0
+
+        while True:
+            # walk workouts by id; one aggregate query per batch
+            batch = list(
+                Workout.objects.filter(id__gt=last_id).order_by("id")
+                .only("id", "total_volume", "set_count", "exercise_count")[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            totals = Workout.compute_totals(WorkoutExercise.objects.filter(workout_id__in=[w.id for w in batch]))
+
+            stale = []
+            for workout in batch:
+                volume, sets, exercises = totals.get(workout.id, (0.0, 0, 0))
+                if (abs(workout.total_volume - volume) > 1e-6
+                        or workout.set_count != sets or workout.exercise_count != exercises):
+                    workout.total_volume, workout.set_count, workout.exercise_count = volume, sets, exercises
+                    stale.append(workout)
+            checked += len(batch)
+            mismatched += len(stale)
+
+            if verify:
+                for workout in stale[:20]:
+                    self.stdout.write(self.style.WARNING(f"Workout {workout.id}: stored totals are stale"))
+            elif stale:
+                with transaction.atomic():
+                    Workout.objects.bulk_update(stale, ["total_volume", "set_count", "exercise_count"])
+
+        if verify:
+            if mismatched:
+                raise CommandError(f"{mismatched} of {checked} workouts have stale totals. Run without --verify to fix.")
+            self.stdout.write(self.style.SUCCESS(f"All {checked} workouts have correct totals."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Checked {checked} workouts, updated {mismatched}."))
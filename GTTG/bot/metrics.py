@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+SAMPLE_SIZE = 512
+
+
+class Timing:
+    __slots__ = ("count", "total", "max", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.samples.append(seconds)
+
+    def percentile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+        return ordered[index]
+
+    def as_dict(self, scale=1000, unit="ms"):
+        return {
+            "count": self.count,
+            f"avg_{unit}": round(self.total / self.count * scale, 2) if self.count else 0.0,
+            f"p50_{unit}": round(self.percentile(0.5) * scale, 2),
+            f"p95_{unit}": round(self.percentile(0.95) * scale, 2),
+            f"max_{unit}": round(self.max * scale, 2),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._timings = {}
+        self._values = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = Timing()
+            timing.add(seconds)
+
+    def record(self, name, value):
+        # distribution of a non-time quantity, e.g. payload sizes in bytes
+        with self._lock:
+            series = self._values.get(name)
+            if series is None:
+                series = self._values[name] = Timing()
+            series.add(value)
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings": {name: t.as_dict() for name, t in self._timings.items()},
+                "values": {name: v.as_dict(scale=1, unit="value") for name, v in self._values.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timings.clear()
+            self._values.clear()
+
+
+metrics = Metrics()
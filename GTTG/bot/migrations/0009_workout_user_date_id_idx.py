@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0008_workout_cycle_day'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='workout',
+            index=models.Index(fields=['user', 'date', 'id'], name='workout_user_date_id_idx'),
+        ),
+    ]
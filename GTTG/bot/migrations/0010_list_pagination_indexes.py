@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0009_workout_user_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trainingcycle',
+            index=models.Index(fields=['user', 'id'], name='trainingcycle_user_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cycleday',
+            index=models.Index(fields=['cycle', 'id'], name='cycleday_cycle_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workout',
+            index=models.Index(fields=['user', 'id'], name='workout_user_id_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0010_list_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workout',
+            name='total_volume',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='workout',
+            name='set_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='workout',
+            name='exercise_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0011_workout_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trainingcycle',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0012_trainingcycle_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workoutexercise',
+            name='client_id',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='workoutexercise',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('client_id__isnull', False)),
+                fields=('workout', 'client_id'),
+                name='workoutexercise_client_id_uniq',
+            ),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+from django.db.models import Count, F, FloatField, Sum
+
+BATCH_SIZE = 1000
+
+
+def backfill_totals(apps, schema_editor):
+    # same aggregate as Workout.compute_totals, which historical models don't have
+    Workout = apps.get_model('bot', 'Workout')
+    WorkoutExercise = apps.get_model('bot', 'WorkoutExercise')
+    last_id = 0
+    while True:
+        batch = list(Workout.objects.filter(id__gt=last_id).order_by('id').only('id')[:BATCH_SIZE])
+        if not batch:
+            return
+        last_id = batch[-1].id
+        rows = (
+            WorkoutExercise.objects.filter(workout_id__in=[w.id for w in batch])
+            .values('workout_id')
+            .annotate(
+                volume=Sum(F('weight') * F('reps'), output_field=FloatField()),
+                sets=Count('id'),
+                exercises=Count('exercise', distinct=True),
+            )
+        )
+        totals = {r['workout_id']: (r['volume'] or 0.0, r['sets'], r['exercises']) for r in rows}
+        for workout in batch:
+            workout.total_volume, workout.set_count, workout.exercise_count = totals.get(workout.id, (0.0, 0, 0))
+        Workout.objects.bulk_update(batch, ['total_volume', 'set_count', 'exercise_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0013_workoutexercise_client_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0014_backfill_workout_totals'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='workout',
+            name='workout_user_id_idx',
+        ),
+    ]
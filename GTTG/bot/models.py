@@ -1,5 +1,6 @@
 import datetime
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, FloatField, Q, Sum
 
 
 class User(models.Model):
@@ -31,6 +32,13 @@ class TrainingCycle(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cycles')
     name = models.CharField(max_length=100)
     length = models.PositiveIntegerField()
+    # bumped whenever the cycle or its days change; keys rendered plan caches
+    version = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='trainingcycle_user_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.user})"
@@ -46,6 +54,9 @@ class CycleDay(models.Model):
 
     class Meta:
         unique_together = ('cycle', 'day_number')
+        indexes = [
+            models.Index(fields=['cycle', 'id'], name='cycleday_cycle_id_idx'),
+        ]
 
     def __str__(self):
         base = f"{self.cycle.name} - Day {self.day_number}"
@@ -60,13 +71,50 @@ class Workout(models.Model):
     is_from_plan = models.BooleanField(default=True)
     muscle_groups = models.ManyToManyField(MuscleGroup, blank=True)
     cycle_day = models.ForeignKey(CycleDay, null=True, blank=True, on_delete=models.SET_NULL, related_name='workouts')
+    # Stored aggregates of the workout's sets, kept in step by refresh_totals()
+    total_volume = models.FloatField(default=0.0)
+    set_count = models.PositiveIntegerField(default=0)
+    exercise_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # keyset pagination of a user's history and of /workouts/?telegram_id=, newest first
+            models.Index(fields=['user', 'date', 'id'], name='workout_user_date_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user} - {self.date}"
 
-    @property
-    def total_volume(self):
-        return sum(exercise.volume for exercise in self.exercises.all())
+    @staticmethod
+    def compute_totals(queryset):
+        # {workout_id: (total_volume, set_count, exercise_count)} from WorkoutExercise rows
+        rows = (
+            queryset.values('workout_id')
+            .annotate(
+                volume=Sum(F('weight') * F('reps'), output_field=FloatField()),
+                sets=Count('id'),
+                exercises=Count('exercise', distinct=True),
+            )
+        )
+        return {r['workout_id']: (r['volume'] or 0.0, r['sets'], r['exercises']) for r in rows}
+
+    @classmethod
+    @transaction.atomic
+    def refresh_totals(cls, *workout_ids):
+        # row locks so concurrent set writes can't interleave their recomputes;
+        # workouts deleted in the meantime are skipped
+        ids = list(
+            cls.objects.select_for_update().filter(id__in=workout_ids)
+            .order_by('id').values_list('id', flat=True)
+        )
+        if not ids:
+            return
+        totals = cls.compute_totals(WorkoutExercise.objects.filter(workout_id__in=ids))
+        workouts = []
+        for workout_id in ids:
+            volume, sets, exercises = totals.get(workout_id, (0.0, 0, 0))
+            workouts.append(cls(id=workout_id, total_volume=volume, set_count=sets, exercise_count=exercises))
+        cls.objects.bulk_update(workouts, ['total_volume', 'set_count', 'exercise_count'])
 
 
 class WorkoutExercise(models.Model):
@@ -74,6 +122,16 @@ class WorkoutExercise(models.Model):
     exercise = models.ForeignKey(Exercise, on_delete=models.CASCADE)
     reps = models.PositiveIntegerField()
     weight = models.FloatField(default=0.0)
+    # set by the bot's write-behind buffer, so a re-sent batch isn't stored twice
+    client_id = models.CharField(max_length=32, null=True, blank=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['workout', 'client_id'], condition=Q(client_id__isnull=False),
+                name='workoutexercise_client_id_uniq',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.workout} - {self.exercise.name} ({self.weight}x{self.reps})"
@@ -0,0 +1,270 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Outgoing Bot API calls go through one pipeline per process: a few sender
+# threads over a keep-alive session, a global and a per-chat token bucket,
+# and retry_after backoff on 429s. Callers still block until their call is
+# answered (handlers need the returned message ids); what changes is the
+# order calls leave in and that a flood wait no longer raises straight away.
+# The buckets are per process, so with several workers split the global rate.
+
+ANSWER, EDIT, SEND = 0, 1, 2
+
+
+def _priority(name):
+    # a pending spinner on a button the user just pressed beats a new message
+    if name == "answerCallbackQuery":
+        return ANSWER
+    if name.startswith(("edit", "delete")):
+        return EDIT
+    return SEND
+
+
+def _passthrough(name):
+    # polling and webhook management aren't chat traffic
+    return name.startswith("get") or name.endswith("Webhook") or name in ("logOut", "close")
+
+
+class TokenBucket:
+    # GCRA: `tat` is when the bucket will be full again; a call may go once
+    # now >= tat - tolerance, where tolerance is the burst allowance.
+    # `blocked_until` is the end of a flood wait Telegram asked for.
+
+    __slots__ = ("interval", "tolerance", "tat", "blocked_until")
+
+    def __init__(self, rate, burst=1):
+        self.interval = 1.0 / rate
+        self.tolerance = self.interval * (max(burst, 1) - 1)
+        self.tat = 0.0
+        self.blocked_until = 0.0
+
+    def available_at(self, now):
+        return max(now, self.tat - self.tolerance)
+
+    def reserve(self, now):
+        # takes the next slot and returns when it starts
+        start = self.available_at(now)
+        self.tat = max(self.tat, now) + self.interval
+        return start
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+        self.tat = max(self.tat, until + self.tolerance)
+
+    def idle(self, now):
+        return self.tat <= now
+
+
+class _Job:
+    __slots__ = ("name", "priority", "chat_id", "args", "kwargs", "queued", "attempts",
+                 "done", "result", "error", "cancelled")
+
+    def __init__(self, name, chat_id, args, kwargs):
+        self.name = name
+        self.priority = _priority(name)
+        self.chat_id = chat_id
+        self.args = args
+        self.kwargs = kwargs
+        self.queued = time.monotonic()
+        self.attempts = 0
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.cancelled = False
+
+
+class OutboundPipeline:
+
+    def __init__(self, workers=8, global_rate=30, chat_rate=1, chat_burst=3,
+                 max_retries=3, max_retry_after=60, max_wait=60):
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate, burst=global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.max_wait = max_wait
+        self.transport = None
+
+        self._chats = {}
+        self._delayed = []  # (not_before, seq, job): waiting on their chat's bucket
+        self._ready = []  # (priority, seq, job)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopped = False
+        self._session = None
+
+    # -- installation ------------------------------------------------------
+
+    def install(self, transport=None):
+        # Routes every Bot API call telebot makes through the pipeline.
+        # `transport` does the actual HTTP (e.g. the async runtime's sender);
+        # by default a pooled requests session.
+        self.transport = transport
+        apihelper.CUSTOM_REQUEST_SENDER = self.sender
+
+    def _session_transport(self, method, url, params=None, files=None, timeout=(3.05, 25), proxies=None):
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session = session
+        started = time.perf_counter()
+        resp = self._session.request(method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+        metrics.observe("telegram." + url.rsplit("/", 1)[-1], time.perf_counter() - started)
+        return resp
+
+    def _send(self, *args, **kwargs):
+        return (self.transport or self._session_transport)(*args, **kwargs)
+
+    # -- callers -----------------------------------------------------------
+
+    def sender(self, method, url, params=None, files=None, timeout=(3.05, 25), proxies=None):
+        # same signature as apihelper.CUSTOM_REQUEST_SENDER
+        name = url.rsplit("/", 1)[-1]
+        if _passthrough(name) or self._stopped:
+            return self._send(method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+
+        chat_id = (params or {}).get("chat_id")
+        job = _Job(name, chat_id, (method, url),
+                   {"params": params, "files": files, "timeout": timeout, "proxies": proxies})
+        self._enqueue(job)
+        if not job.done.wait(self.max_wait + timeout[0] + timeout[1]):
+            with self._cond:
+                job.cancelled = True
+            if not job.done.is_set():
+                metrics.incr("outbound.expired")
+                raise requests.Timeout(f"{name} still queued after {self.max_wait}s")
+        metrics.observe("outbound." + name, time.monotonic() - job.queued)
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _enqueue(self, job, not_before=0.0):
+        with self._cond:
+            self._start()
+            now = time.monotonic()
+            bucket = self._chats.get(job.chat_id) if job.chat_id is not None else None
+            if bucket is not None:
+                # a chat in a flood wait gets nothing, edits and deletes included
+                not_before = max(not_before, bucket.blocked_until)
+            if job.chat_id is not None and job.priority == SEND:
+                # the per-chat rate is on new messages; edits and deletes
+                # only count against the global bucket
+                if bucket is None:
+                    bucket = self._chats[job.chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+                not_before = max(not_before, bucket.reserve(max(now, not_before)))
+            if not_before > now:
+                heapq.heappush(self._delayed, (not_before, next(self._seq), job))
+            else:
+                heapq.heappush(self._ready, (job.priority, next(self._seq), job))
+            self._depth()
+            self._cond.notify()
+
+    def _depth(self):
+        metrics.gauge("outbound.queue_depth", len(self._ready) + len(self._delayed))
+
+    # -- sender threads ----------------------------------------------------
+
+    def _start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"outbound-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _next(self):
+        with self._cond:
+            while not self._stopped:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, seq, job = heapq.heappop(self._delayed)
+                    heapq.heappush(self._ready, (job.priority, seq, job))
+                wake = self._delayed[0][0] if self._delayed else None
+                if self._ready:
+                    go = self.global_bucket.available_at(now)
+                    if go <= now:
+                        _, seq, job = heapq.heappop(self._ready)
+                        if job.cancelled:
+                            self._depth()
+                            continue
+                        bucket = self._chats.get(job.chat_id) if job.chat_id is not None else None
+                        if bucket is not None and bucket.blocked_until > now:
+                            # queued before its chat got a flood wait
+                            heapq.heappush(self._delayed, (bucket.blocked_until, seq, job))
+                            continue
+                        self._depth()
+                        self.global_bucket.reserve(now)
+                        self._prune(now)
+                        return job
+                    wake = go if wake is None else min(wake, go)
+                self._cond.wait(None if wake is None else wake - now)
+        return None
+
+    def _prune(self, now):
+        if len(self._chats) > 10000:
+            self._chats = {chat: bucket for chat, bucket in self._chats.items() if not bucket.idle(now)}
+
+    def _work(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            metrics.observe("outbound.queue_wait", time.monotonic() - job.queued)
+            job.attempts += 1
+            try:
+                resp = self._send(*job.args, **job.kwargs)
+            except Exception as e:
+                job.error = e
+                job.done.set()
+                continue
+            if resp.status_code == 429 and self._retry(job, resp):
+                continue
+            job.result = resp
+            job.done.set()
+
+    def _retry(self, job, resp):
+        try:
+            retry_after = float(resp.json()["parameters"]["retry_after"])
+        except Exception:
+            retry_after = 1.0
+        metrics.incr("outbound.flood_wait")
+        logger.warning("Flood wait %.0fs on %s (chat %s)", retry_after, job.name, job.chat_id)
+        until = time.monotonic() + retry_after
+        with self._cond:
+            if job.chat_id is not None:
+                bucket = self._chats.setdefault(job.chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+                bucket.block(until)
+            else:
+                self.global_bucket.block(until)
+        if job.attempts > self.max_retries or retry_after > self.max_retry_after:
+            # telebot raises the 429 as before
+            return False
+        metrics.incr("outbound.retries")
+        self._enqueue(job, not_before=until)
+        return True
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            queued = [job for _, _, job in self._ready + self._delayed]
+            self._ready, self._delayed = [], []
+            self._depth()
+            self._cond.notify_all()
+        for job in queued:
+            job.error = requests.ConnectionError("outbound pipeline stopped")
+            job.done.set()
@@ -0,0 +1,23 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    # Opt-in keyset pagination for list endpoints: plain list responses stay
+    # as they were unless the client sends ?cursor= or ?page_size=. Pages are
+    # ordered by the view's `cursor_ordering`, which matches the list's own
+    # order and an index in the model Meta, so each page is an index range
+    # scan. Rows tied on the first column are told apart by the cursor offset.
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = 'id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', self.ordering)
+        return (ordering,) if isinstance(ordering, str) else tuple(ordering)
@@ -0,0 +1,35 @@
+import re
+
+# Several sets in one message, at the weight prompt:
+#   80x5x3          -> 3 sets of 5 reps at 80 kg
+#   80x5, 85x5, 90x3 -> one set per item
+# "x" may also be written as "*", "×" or the Cyrillic "х".
+MAX_SETS = 20
+
+_SEPARATORS = re.compile(r"[,;\n]+")
+_ITEM = re.compile(
+    r"^\s*(?P<weight>\d+(?:\.\d+)?)\s*[xх×*]\s*(?P<reps>\d+)(?:\s*[xх×*]\s*(?P<count>\d+))?\s*$",
+    re.IGNORECASE,
+)
+
+
+def parse_sets(text):
+    # [(weight, reps), ...] or None when the text isn't quick entry
+    if not text:
+        return None
+    sets = []
+    for item in _SEPARATORS.split(text.strip()):
+        if not item.strip():
+            continue
+        match = _ITEM.match(item)
+        if match is None:
+            return None
+        weight = float(match["weight"])
+        reps = int(match["reps"])
+        count = int(match["count"] or 1)
+        if reps < 1 or count < 1:
+            return None
+        sets.extend([(weight, reps)] * count)
+        if len(sets) > MAX_SETS:
+            return None
+    return sets or None
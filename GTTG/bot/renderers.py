@@ -0,0 +1,97 @@
+from django.utils.http import parse_header_parameters
+from rest_framework import renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.utils import encoders
+from rest_framework.utils.mediatypes import media_type_matches
+
+# Both codecs are optional: without orjson the JSON classes behave like DRF's
+# stock ones, and the MessagePack classes are only enabled in settings when
+# msgpack is installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+
+# whatever orjson / msgpack can't encode natively (Decimal, lazy strings, ...)
+_fallback = encoders.JSONEncoder().default
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=_fallback, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONParser(JSONParser):
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    media_type = MSGPACK_MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_fallback, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, strict_map_key=False)
+        except (ValueError, msgpack.UnpackException) as exc:
+            raise ParseError('MessagePack parse error - %s' % str(exc))
+
+
+def _quality(value):
+    try:
+        return float(parse_header_parameters(value)[1].get('q', 1))
+    except ValueError:
+        return 0.0
+
+
+class ClientPreferenceNegotiation(DefaultContentNegotiation):
+    # DRF settles equally specific Accept entries by renderer order and
+    # ignores q, so "application/msgpack, application/json;q=0.9" would still
+    # get JSON. Move the renderers the client ranks higher to the front;
+    # wildcard-only clients (browsers, curl) keep the configured order.
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        wanted = sorted(
+            (-_quality(value), position, value)
+            for position, value in enumerate(self.get_accept_list(request))
+            if not value.startswith('*/')
+        )
+
+        def rank(renderer):
+            for negative_q, position, value in wanted:
+                if media_type_matches(renderer.media_type, value):
+                    return (negative_q, position)
+            return (1, 0)
+
+        return super().select_renderer(request, sorted(renderers, key=rank), format_suffix)
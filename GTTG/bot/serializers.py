@@ -1,21 +1,23 @@
+from django.db import transaction
 from rest_framework import serializers
 from datetime import datetime
 from .models import User, MuscleGroup, Exercise, TrainingCycle, CycleDay, Workout, WorkoutExercise
+from .sparse import SparseFieldsMixin
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = '__all__'
 
 
-class MuscleGroupSerializer(serializers.ModelSerializer):
+class MuscleGroupSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = MuscleGroup
         fields = '__all__'
 
 
-class ExerciseSerializer(serializers.ModelSerializer):
+class ExerciseSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     muscle_group = MuscleGroupSerializer(read_only=True)
 
     class Meta:
@@ -23,7 +25,7 @@ class ExerciseSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class CycleDaySerializer(serializers.ModelSerializer):
+class CycleDaySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     default_exercises = serializers.PrimaryKeyRelatedField(
         many=True, queryset=Exercise.objects.all(), required=False
     )
@@ -33,12 +35,13 @@ class CycleDaySerializer(serializers.ModelSerializer):
         fields = ['id', 'cycle', 'day_number', 'is_training_day', 'muscle_groups', 'default_exercises', 'title']
 
 
-class TrainingCycleSerializer(serializers.ModelSerializer):
+class TrainingCycleSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     telegram_id = serializers.IntegerField(write_only=True)
 
     class Meta:
         model = TrainingCycle
-        fields = ['id', 'name', 'length', 'telegram_id']
+        fields = ['id', 'name', 'length', 'version', 'telegram_id']
+        read_only_fields = ['version']
 
     def create(self, validated_data):
         telegram_id = validated_data.pop('telegram_id')
@@ -46,7 +49,77 @@ class TrainingCycleSerializer(serializers.ModelSerializer):
         return TrainingCycle.objects.create(user=user, **validated_data)
 
 
-class WorkoutExerciseSerializer(serializers.ModelSerializer):
+class PlanDaySerializer(serializers.Serializer):
+    day_number = serializers.IntegerField(min_value=1)
+    is_training_day = serializers.BooleanField(default=True)
+    muscle_groups = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    default_exercises = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    title = serializers.CharField(max_length=100, required=False, allow_null=True, allow_blank=True)
+
+
+class TrainingCyclePlanSerializer(TrainingCycleSerializer):
+    # Whole plan in one request: cycle + days + M2M rows, in one transaction
+    days = PlanDaySerializer(many=True, write_only=True)
+
+    class Meta(TrainingCycleSerializer.Meta):
+        fields = TrainingCycleSerializer.Meta.fields + ['days']
+
+    def validate(self, attrs):
+        days = attrs['days']
+        numbers = [d['day_number'] for d in days]
+        if len(set(numbers)) != len(numbers):
+            raise serializers.ValidationError({'days': 'Duplicate day_number.'})
+        if any(n > attrs['length'] for n in numbers):
+            raise serializers.ValidationError({'days': 'day_number is greater than the cycle length.'})
+
+        # one query per table for all days
+        group_ids = {g for d in days for g in d['muscle_groups']}
+        exercise_ids = {e for d in days for e in d['default_exercises']}
+        missing_groups = group_ids - set(MuscleGroup.objects.filter(id__in=group_ids).values_list('id', flat=True))
+        missing_exercises = exercise_ids - set(Exercise.objects.filter(id__in=exercise_ids).values_list('id', flat=True))
+        errors = {}
+        if missing_groups:
+            errors['muscle_groups'] = f"Unknown ids: {sorted(missing_groups)}"
+        if missing_exercises:
+            errors['default_exercises'] = f"Unknown ids: {sorted(missing_exercises)}"
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
+
+    @transaction.atomic
+    def create(self, validated_data):
+        days_data = validated_data.pop('days')
+        cycle = super().create(validated_data)
+
+        days = CycleDay.objects.bulk_create([
+            CycleDay(
+                cycle=cycle,
+                day_number=d['day_number'],
+                is_training_day=d['is_training_day'],
+                title=d.get('title') or None,
+            )
+            for d in days_data
+        ])
+        GroupLink = CycleDay.muscle_groups.through
+        ExerciseLink = CycleDay.default_exercises.through
+        GroupLink.objects.bulk_create([
+            GroupLink(cycleday_id=day.id, musclegroup_id=gid)
+            for day, d in zip(days, days_data) for gid in dict.fromkeys(d['muscle_groups'])
+        ])
+        ExerciseLink.objects.bulk_create([
+            ExerciseLink(cycleday_id=day.id, exercise_id=eid)
+            for day, d in zip(days, days_data) for eid in dict.fromkeys(d['default_exercises'])
+        ])
+        return cycle
+
+    def to_representation(self, instance):
+        ret = super().to_representation(instance)
+        days = instance.days.order_by('day_number').prefetch_related('muscle_groups', 'default_exercises')
+        ret['days'] = CycleDaySerializer(days, many=True).data
+        return ret
+
+
+class WorkoutExerciseSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     exercise = ExerciseSerializer(read_only=True)
     volume = serializers.SerializerMethodField()
 
@@ -58,24 +131,45 @@ class WorkoutExerciseSerializer(serializers.ModelSerializer):
         return obj.volume
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     exercises = WorkoutExerciseSerializer(many=True, read_only=True)
     muscle_groups = MuscleGroupSerializer(many=True, read_only=True)
     telegram_id = serializers.IntegerField(write_only=True, required=False)
     cycle_day = CycleDaySerializer(read_only=True)
     cycle_day_id = serializers.PrimaryKeyRelatedField(source='cycle_day', queryset=CycleDay.objects.all(), write_only=True, required=False)
-    total_volume = serializers.SerializerMethodField()
 
     class Meta:
         model = Workout
-        fields = ['id', 'date', 'user', 'telegram_id', 'is_from_plan', 'muscle_groups', 'exercises', 'cycle_day', 'cycle_day_id', 'total_volume']
-        read_only_fields = ['id', 'date']
+        fields = ['id', 'date', 'user', 'telegram_id', 'is_from_plan', 'muscle_groups', 'exercises', 'cycle_day', 'cycle_day_id',
+                  'total_volume', 'set_count', 'exercise_count']
+        read_only_fields = ['id', 'date', 'total_volume', 'set_count', 'exercise_count']
 
-    def get_total_volume(self, obj):
-        return obj.total_volume
-    
     def to_representation(self, instance):
         ret = super().to_representation(instance)
         if isinstance(instance.date, datetime):
             ret['date'] = instance.date.date().isoformat()
         return ret
+
+
+class WorkoutHistorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Slim row for history lists: no exercises, no nested cycle day
+    title = serializers.SerializerMethodField()
+    muscle_groups = serializers.SerializerMethodField()
+    label = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Workout
+        fields = ['id', 'date', 'is_from_plan', 'title', 'muscle_groups', 'label', 'total_volume', 'set_count']
+
+    def get_title(self, obj):
+        if obj.is_from_plan and obj.cycle_day is not None:
+            return (obj.cycle_day.title or "").strip() or None
+        return None
+
+    def get_muscle_groups(self, obj):
+        return [g.name for g in obj.muscle_groups.all()]
+
+    def get_label(self, obj):
+        core = self.get_title(obj) or ", ".join(self.get_muscle_groups(obj)) or "No groups"
+        suffix = "" if obj.is_from_plan else " (custom)"
+        return f"{obj.date.strftime('%d-%m-%Y')} - {core}{suffix}"
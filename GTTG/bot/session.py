@@ -0,0 +1,417 @@
+import functools
+import json
+import logging
+import threading
+import time
+import uuid
+import zlib
+from collections.abc import MutableMapping
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = "user:{}:session"
+LOCK_KEY = "user:{}:lock"
+# the JSON blob sessions were stored as before; moved into the hash on first load
+LEGACY_KEY = "user:{}:data"
+# held locks are renewed every third of the TTL for as long as the handler
+# runs; the TTL only matters once a holder has crashed
+LOCK_TTL_MS = 10000
+LOCK_WAIT_SECONDS = 30.0
+LOCK_RETRY_SECONDS = 0.05
+SESSION_TTL_SECONDS = 7 * 24 * 3600
+SESSION_MAX_BYTES = 16 * 1024
+COMPRESS_MIN_BYTES = 256
+
+# Field values are tagged bytes: b"j" + compact JSON, or b"z" + zlib(JSON)
+PLAIN = b"j"
+COMPRESSED = b"z"
+
+RENEW_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def encode_value(value, compress_min=COMPRESS_MIN_BYTES):
+    payload = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if compress_min is not None and len(payload) >= compress_min:
+        packed = zlib.compress(payload)
+        if len(packed) < len(payload):
+            return COMPRESSED + packed
+    return PLAIN + payload
+
+
+def decode_value(raw):
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    tag, body = raw[:1], raw[1:]
+    if tag == COMPRESSED:
+        body = zlib.decompress(body)
+    elif tag != PLAIN:
+        raise ValueError(f"Unknown session encoding {tag!r}")
+    return json.loads(body)
+
+
+class SessionTooLarge(Exception):
+    pass
+
+
+class SessionBusy(Exception):
+    # another update of the same user held the lock for the whole wait
+    pass
+
+
+def _field_name(field):
+    return field.decode("utf-8") if isinstance(field, bytes) else field
+
+
+class Session(MutableMapping):
+    # Dict-like view of the user:{id}:session hash. Fields are loaded on first
+    # access and decoded on demand; flush() writes only fields whose encoded
+    # value changed, in one pipelined MULTI.
+
+    def __init__(self, store, user_id, locked=False):
+        self.store = store
+        self.user_id = user_id
+        self.key = SESSION_KEY.format(user_id)
+        self.locked = locked
+        self._lock_token = None
+        self._raw = None
+        self._values = {}
+        self._deleted = set()
+        self._cleared = False
+
+    def _ensure_loaded(self):
+        if self._raw is None:
+            self._raw = self.store.load(self)
+
+    def __getitem__(self, field):
+        if field in self._values:
+            return self._values[field]
+        self._ensure_loaded()
+        if field in self._deleted or field not in self._raw:
+            raise KeyError(field)
+        value = self._values[field] = self.store.decode(self._raw[field])
+        return value
+
+    def __setitem__(self, field, value):
+        self._values[field] = value
+        self._deleted.discard(field)
+
+    def __delitem__(self, field):
+        if field not in self:
+            raise KeyError(field)
+        self._values.pop(field, None)
+        self._deleted.add(field)
+
+    def __contains__(self, field):
+        if field in self._values:
+            return True
+        self._ensure_loaded()
+        return field in self._raw and field not in self._deleted
+
+    def __iter__(self):
+        self._ensure_loaded()
+        keys = dict.fromkeys(self._raw)
+        keys.update(dict.fromkeys(self._values))
+        return iter([k for k in keys if k not in self._deleted])
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def clear(self):
+        self._raw = {}
+        self._values = {}
+        self._deleted = set()
+        self._cleared = True
+
+    def replace(self, mapping):
+        self.clear()
+        self.update(mapping)
+
+    def to_dict(self):
+        return {k: self[k] for k in self}
+
+    def changes(self):
+        raw = self._raw or {}
+        changed = {}
+        for field, value in self._values.items():
+            encoded = self.store.encode(value)
+            if raw.get(field) != encoded:
+                changed[field] = encoded
+        deleted = [f for f in self._deleted if f in raw]
+        return changed, deleted
+
+    def flush(self):
+        if self.locked and self._raw is None and (self._values or self._cleared):
+            # written without being read: still take the lock before writing
+            self._ensure_loaded()
+        changed, deleted = self.changes()
+        if self._cleared or changed or deleted:
+            size = self._size(changed, deleted)
+            if size > self.store.max_bytes:
+                metrics.incr("session.over_cap")
+                self._shed(changed, deleted)
+                changed, deleted = self.changes()
+                size = self._size(changed, deleted)
+            if size > self.store.max_bytes:
+                if self._lock_token is not None:
+                    self.store.release(self)
+                raise SessionTooLarge(f"Session of user {self.user_id} would take {size} bytes")
+            self.store.write(self, changed, deleted)
+            metrics.record("session.size_bytes", size)
+            raw = {} if self._cleared else dict(self._raw or {})
+            for f in deleted:
+                raw.pop(f, None)
+            raw.update(changed)
+            self._raw = raw
+            self._deleted = set()
+            self._cleared = False
+        if self._lock_token is not None:
+            self.store.release(self)
+
+    def _size(self, changed, deleted):
+        raw = {} if self._cleared else dict(self._raw or {})
+        for f in deleted:
+            raw.pop(f, None)
+        raw.update(changed)
+        return sum(len(f) + len(v) for f, v in raw.items())
+
+    def _shed(self, changed, deleted):
+        # Leaves the largest changed fields unsaved until the rest fits, then
+        # lets the store's on_too_large hook react (reset the flow, tell the
+        # user). The stored values of the shed fields stay as they were.
+        shed = []
+        for field in sorted(changed, key=lambda f: len(changed[f]), reverse=True):
+            if self._size(*self.changes()) <= self.store.max_bytes:
+                break
+            self._values.pop(field, None)
+            shed.append(field)
+        logger.warning("Session of user %s over %s bytes; not saving %s", self.user_id, self.store.max_bytes, shed)
+        if self.store.on_too_large is not None:
+            self.store.on_too_large(self, shed)
+
+
+class SessionStore:
+    # `client` must not decode responses: field values are binary.
+
+    def __init__(self, client, ttl=SESSION_TTL_SECONDS, max_bytes=SESSION_MAX_BYTES,
+                 compress_min=COMPRESS_MIN_BYTES, lock_ttl_ms=LOCK_TTL_MS, lock_wait=LOCK_WAIT_SECONDS,
+                 on_too_large=None):
+        self.client = client
+        # on_too_large(session, shed_fields): called when a flush had to leave
+        # fields unsaved to stay under max_bytes; may still change the session
+        self.on_too_large = on_too_large
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compress_min = compress_min
+        self.lock_ttl_ms = lock_ttl_ms
+        self.lock_wait = lock_wait
+        self._local = threading.local()
+        self._held = {}  # lock key -> token, renewed by the keeper thread
+        self._held_lock = threading.Lock()
+        self._keeper = None
+
+    def encode(self, value):
+        return encode_value(value, self.compress_min)
+
+    decode = staticmethod(decode_value)
+
+    def load(self, session):
+        # one round trip: take the per-user lock (if scoped) and read the hash
+        deadline = time.monotonic() + self.lock_wait
+        while True:
+            pipe = self.client.pipeline(transaction=False)
+            token = None
+            if session.locked:
+                token = uuid.uuid4().hex
+                pipe.set(LOCK_KEY.format(session.user_id), token, nx=True, px=self.lock_ttl_ms)
+            pipe.hgetall(session.key)
+            pipe.expire(session.key, self.ttl)  # sliding expiry for idle sessions
+            pipe.get(LEGACY_KEY.format(session.user_id))
+            with metrics.timer("session.load"):
+                results = pipe.execute()
+            raw = {_field_name(f): v for f, v in results[-3].items()}
+            if not session.locked or results[0]:
+                if token is not None:
+                    session._lock_token = token
+                    self._hold(session)
+                if results[-1] is not None:
+                    raw = self._migrate_legacy(session, raw, results[-1])
+                return raw
+            if time.monotonic() >= deadline:
+                # holders renew their lock, so it is still in use: carrying on
+                # unlocked could lose the other update's writes
+                metrics.incr("session.lock_timeout")
+                raise SessionBusy(f"Session of user {session.user_id} stayed locked for {self.lock_wait}s")
+            metrics.incr("session.lock_wait")
+            time.sleep(LOCK_RETRY_SECONDS)
+
+    def _migrate_legacy(self, session, raw, legacy):
+        # fields already in the hash win over the old blob
+        try:
+            data = json.loads(legacy)
+        except ValueError:
+            data = {}
+        moved = {field: self.encode(value) for field, value in data.items() if field not in raw}
+        pipe = self.client.pipeline(transaction=True)
+        if moved:
+            pipe.hset(session.key, mapping=moved)
+            pipe.expire(session.key, self.ttl)
+        pipe.delete(LEGACY_KEY.format(session.user_id))
+        pipe.execute()
+        metrics.incr("session.legacy_migrated")
+        return dict(raw, **moved)
+
+    def expire_legacy(self, ttl=None):
+        # gives old user:{id}:data blobs of users who never came back a TTL
+        expired = 0
+        for key in self.client.scan_iter(match=LEGACY_KEY.format("*"), count=1000):
+            if self.client.ttl(key) == -1:
+                self.client.expire(key, ttl or self.ttl)
+                expired += 1
+        return expired
+
+    # Lock renewal
+
+    def _hold(self, session):
+        with self._held_lock:
+            self._held[LOCK_KEY.format(session.user_id)] = session._lock_token
+            if self._keeper is None:
+                self._keeper = threading.Thread(target=self._renew_locks, name="session-locks", daemon=True)
+                self._keeper.start()
+
+    def _unhold(self, session):
+        with self._held_lock:
+            self._held.pop(LOCK_KEY.format(session.user_id), None)
+
+    def _renew_locks(self):
+        while True:
+            time.sleep(self.lock_ttl_ms / 3000)
+            with self._held_lock:
+                held = list(self._held.items())
+            if not held:
+                continue
+            try:
+                pipe = self.client.pipeline(transaction=False)
+                for key, token in held:
+                    pipe.eval(RENEW_LOCK, 1, key, token, self.lock_ttl_ms)
+                pipe.execute()
+            except Exception as e:
+                logger.warning("Could not renew session locks: %s", e)
+
+    def write(self, session, changed, deleted):
+        pipe = self.client.pipeline(transaction=True)
+        if session._cleared:
+            pipe.delete(session.key)
+        if deleted:
+            pipe.hdel(session.key, *deleted)
+        if changed:
+            pipe.hset(session.key, mapping=changed)
+            pipe.expire(session.key, self.ttl)
+        if session._lock_token is not None:
+            pipe.eval(RELEASE_LOCK, 1, LOCK_KEY.format(session.user_id), session._lock_token)
+            self._unhold(session)
+            session._lock_token = None
+        with metrics.timer("session.flush"):
+            pipe.execute()
+        metrics.incr("session.fields_written", len(changed) + len(deleted))
+
+    def release(self, session):
+        self._unhold(session)
+        self.client.eval(RELEASE_LOCK, 1, LOCK_KEY.format(session.user_id), session._lock_token)
+        session._lock_token = None
+
+    def memory_report(self, sample=200):
+        # MEMORY USAGE of a sample of live sessions, to compare encodings
+        sizes = []
+        fields = 0
+        for key in self.client.scan_iter(match=SESSION_KEY.format("*"), count=1000):
+            usage = self.client.memory_usage(key)
+            if usage is not None:
+                sizes.append(usage)
+                fields += self.client.hlen(key)
+            if len(sizes) >= sample:
+                break
+        return {
+            "sampled": len(sizes),
+            "avg_bytes": round(sum(sizes) / len(sizes)) if sizes else 0,
+            "max_bytes": max(sizes, default=0),
+            "avg_fields": round(fields / len(sizes), 1) if sizes else 0,
+            "flushes": metrics.snapshot()["values"].get("session.size_bytes"),
+        }
+
+    # Per-update scoping
+
+    def _scopes(self):
+        scopes = getattr(self._local, "scopes", None)
+        if scopes is None:
+            scopes = self._local.scopes = {}
+        return scopes
+
+    def current(self, user_id):
+        return self._scopes().get(user_id)
+
+    def get(self, user_id):
+        session = self.current(user_id)
+        if session is None:
+            session = Session(self, user_id)
+        return session
+
+    def save(self, user_id, data):
+        session = self.current(user_id)
+        if session is None:
+            session = data if isinstance(data, Session) else Session(self, user_id)
+            if session is not data:
+                session.replace(data)
+            session.flush()
+        elif data is not session:
+            session.replace(data)
+
+    def pop(self, user_id):
+        session = self.get(user_id)
+        data = session.to_dict()
+        session.clear()
+        if self.current(user_id) is None:
+            session.flush()
+        return data
+
+    def scoped(self, func):
+        # Decorator for update handlers: one session per user per update,
+        # flushed (and its lock released) in a single pipeline at the end.
+        @functools.wraps(func)
+        def wrapper(update, *args, **kwargs):
+            user_id = update.from_user.id
+            scopes = self._scopes()
+            if user_id in scopes:
+                return func(update, *args, **kwargs)
+            session = scopes[user_id] = Session(self, user_id, locked=True)
+            busy = False
+            try:
+                return func(update, *args, **kwargs)
+            except SessionBusy as e:
+                # nothing of the session was read, so nothing is written
+                busy = True
+                logger.warning("Dropping update: %s", e)
+            finally:
+                del scopes[user_id]
+                if not busy:
+                    try:
+                        session.flush()
+                    except SessionTooLarge as e:
+                        # the update's changes are dropped; the stored session stays as it was
+                        logger.warning("%s", e)
+                    except SessionBusy as e:
+                        logger.warning("Dropping session changes: %s", e)
+        return wrapper
@@ -0,0 +1,187 @@
+import json
+import logging
+import threading
+import time
+import uuid
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Logged sets wait in workout:{id}:sets until flushed to the API in one bulk
+# request. sets:pending scores each workout by when its oldest unflushed set
+# was buffered; the flush timer works through it, so buffers left behind by a
+# crashed worker are picked up by whichever worker runs next. Every set gets
+# a client id when it is buffered and the bulk endpoint skips ids it already
+# stored, so a batch posted twice (crash before the trim, lost lock) is
+# stored once.
+BUFFER_KEY = "workout:{}:sets"
+FLUSH_LOCK_KEY = "workout:{}:sets:flush"
+PENDING_KEY = "sets:pending"
+MAX_BATCH = 20
+MAX_AGE_SECONDS = 30
+# renewed before every batch; must outlast one POST (connect + read timeout)
+FLUSH_LOCK_MS = 30000
+
+# drop what was flushed, unless the lock was lost meanwhile (then the new
+# holder trims); forget the workout only if nothing new arrived meanwhile
+TRIM_FLUSHED = """
+if redis.call('get', KEYS[3]) ~= ARGV[3] then
+    return 0
+end
+redis.call('ltrim', KEYS[1], ARGV[1], -1)
+if redis.call('llen', KEYS[1]) == 0 then
+    redis.call('zrem', KEYS[2], ARGV[2])
+end
+return 1
+"""
+
+RENEW_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SetBuffer:
+    # `post(workout_id, sets)` writes a batch and returns an ApiResponse.
+
+    def __init__(self, client, post, max_batch=MAX_BATCH, max_age=MAX_AGE_SECONDS):
+        self.client = client
+        self.post = post
+        self.max_batch = max_batch
+        self.max_age = max_age
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def append(self, workout_id, sets):
+        self.start()
+        key = BUFFER_KEY.format(workout_id)
+        pipe = self.client.pipeline()
+        pipe.rpush(key, *(
+            json.dumps(dict(s, client_id=s.get("client_id") or uuid.uuid4().hex), separators=(",", ":"))
+            for s in sets
+        ))
+        pipe.zadd(PENDING_KEY, {workout_id: time.time()}, nx=True)
+        size = pipe.execute()[0]
+        metrics.incr("sets.buffered", len(sets))
+        if size >= self.max_batch:
+            self.flush(workout_id)
+        return size
+
+    def pending(self, workout_id):
+        return [json.loads(raw) for raw in self.client.lrange(BUFFER_KEY.format(workout_id), 0, -1)]
+
+    def flush(self, workout_id, wait=0):
+        # True once everything buffered for the workout is stored by the API
+        key = BUFFER_KEY.format(workout_id)
+        token = uuid.uuid4().hex
+        lock_key = FLUSH_LOCK_KEY.format(workout_id)
+        deadline = time.monotonic() + wait
+        while not self.client.set(lock_key, token, nx=True, px=FLUSH_LOCK_MS):
+            # another worker is flushing it right now
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        try:
+            while True:
+                if not self.client.eval(RENEW_LOCK, 1, lock_key, token, FLUSH_LOCK_MS):
+                    # a slow batch outlived the lock and another worker took over
+                    metrics.incr("sets.flush_lock_lost")
+                    return False
+                raw = self.client.lrange(key, 0, self.max_batch - 1)
+                if not raw:
+                    self.client.zrem(PENDING_KEY, workout_id)
+                    return True
+                if not self._post_batch(workout_id, [json.loads(r) for r in raw]):
+                    return False
+                if not self.client.eval(TRIM_FLUSHED, 3, key, PENDING_KEY, lock_key, len(raw), workout_id, token):
+                    metrics.incr("sets.flush_lock_lost")
+                    return False
+        finally:
+            self.client.eval(RELEASE_LOCK, 1, lock_key, token)
+
+    def _post_batch(self, workout_id, batch):
+        # True once the batch is stored or known to be unstorable
+        with metrics.timer("sets.flush"):
+            resp = self.post(workout_id, batch)
+        rejected = self._rejected(resp) if resp.status_code == 400 else None
+        if rejected:
+            # drop just the sets the API refused and send the rest again
+            logger.error("Dropping %s buffered sets for workout %s: %s", len(rejected), workout_id, resp.text)
+            metrics.incr("sets.dropped", len(rejected))
+            batch = [s for i, s in enumerate(batch) if i not in rejected]
+            if not batch:
+                return True
+            with metrics.timer("sets.flush"):
+                resp = self.post(workout_id, batch)
+        if resp.status_code == 201:
+            metrics.incr("sets.flushed", len(batch))
+        elif resp.status_code in (400, 404):
+            # workout deleted or a malformed request: retrying won't help
+            metrics.incr("sets.dropped", len(batch))
+            logger.error("Dropping %s buffered sets for workout %s: %s %s",
+                         len(batch), workout_id, resp.status_code, resp.text)
+        else:
+            metrics.incr("sets.flush_failed")
+            logger.warning("Flushing sets for workout %s failed: %s", workout_id, resp.status_code)
+            return False
+        return True
+
+    @staticmethod
+    def _rejected(resp):
+        try:
+            return {r["index"] for r in resp.json().get("rejected") or ()}
+        except Exception:
+            return None
+
+    def flush_due(self):
+        due = self.client.zrangebyscore(PENDING_KEY, "-inf", time.time() - self.max_age)
+        for workout_id in due:
+            try:
+                self.flush(workout_id)
+            except Exception:
+                logger.exception("Flushing sets for workout %s failed", workout_id)
+        return len(due)
+
+    def lag(self):
+        oldest = self.client.zrange(PENDING_KEY, 0, 0, withscores=True)
+        workouts = self.client.zrange(PENDING_KEY, 0, -1)
+        pipe = self.client.pipeline(transaction=False)
+        for workout_id in workouts:
+            pipe.llen(BUFFER_KEY.format(workout_id))
+        sizes = pipe.execute() if workouts else []
+        return {
+            "workouts": len(workouts),
+            "sets": sum(sizes),
+            "oldest_seconds": round(time.time() - oldest[0][1], 1) if oldest else 0,
+        }
+
+    # Flush timer
+
+    def start(self):
+        if self._timer is not None:
+            return
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._run, name="set-buffer", daemon=True)
+                self._timer.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.flush_due()
+                lag = self.lag()
+                metrics.gauge("sets.pending", lag["sets"])
+                metrics.gauge("sets.lag_seconds", lag["oldest_seconds"])
+            except Exception:
+                logger.exception("Set buffer flush pass failed")
+            time.sleep(max(1, self.max_age / 3))
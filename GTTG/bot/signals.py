@@ -0,0 +1,129 @@
+import logging
+
+import redis
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .catalog_cache import publish_catalog_change
+from .models import CycleDay, Exercise, MuscleGroup, TrainingCycle, User, Workout, WorkoutExercise
+
+logger = logging.getLogger(__name__)
+
+_redis = None
+
+
+def get_redis():
+    global _redis
+    if _redis is None and settings.REDIS_URL:
+        _redis = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _redis
+
+
+def _publish_catalog_change():
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        publish_catalog_change(client)
+    except redis.RedisError as e:
+        logger.warning("Could not publish catalog invalidation: %s", e)
+
+
+@receiver([post_save, post_delete], sender=MuscleGroup)
+@receiver([post_save, post_delete], sender=Exercise)
+def catalog_changed(sender, **kwargs):
+    # one invalidation per transaction, even for a bulk loaddata
+    if any(func is _publish_catalog_change for _, func, _ in connection.run_on_commit):
+        return
+    transaction.on_commit(_publish_catalog_change)
+
+
+class _RefreshTotals:
+    # on-commit callback that recomputes every workout touched in the
+    # transaction once, instead of once per saved or deleted set
+
+    def __init__(self):
+        self.workout_ids = set()
+
+    def __call__(self):
+        Workout.refresh_totals(*self.workout_ids)
+
+
+@receiver([post_save, post_delete], sender=WorkoutExercise)
+def workout_sets_changed(sender, instance, **kwargs):
+    # bulk_create sends no signals; its callers refresh the totals themselves
+    pending = next((func for _, func, _ in connection.run_on_commit if isinstance(func, _RefreshTotals)), None)
+    if pending is None:
+        pending = _RefreshTotals()
+        pending.workout_ids.add(instance.workout_id)
+        transaction.on_commit(pending)
+    else:
+        pending.workout_ids.add(instance.workout_id)
+
+
+def _drop_plan_snapshots(telegram_ids):
+    from .snapshots import invalidate_plan_snapshots
+
+    client = get_redis()
+    if client is None or not telegram_ids:
+        return
+    try:
+        invalidate_plan_snapshots(client, telegram_ids)
+    except redis.RedisError as e:
+        # the snapshots still expire on their own
+        logger.warning("Could not invalidate plan snapshots: %s", e)
+
+
+def _plan_changed(cycle_id):
+    # the owner and whoever has the cycle as current
+    telegram_ids = list(
+        User.objects.filter(Q(cycles__id=cycle_id) | Q(current_cycle_id=cycle_id))
+        .values_list('telegram_id', flat=True).distinct()
+    )
+    transaction.on_commit(lambda: _drop_plan_snapshots(telegram_ids))
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    # current_cycle lives on the user row
+    transaction.on_commit(lambda: _drop_plan_snapshots([instance.telegram_id]))
+
+
+@receiver(post_save, sender=TrainingCycle)
+@receiver(pre_delete, sender=TrainingCycle)
+def cycle_changed(sender, instance, **kwargs):
+    # before the delete: current_cycle is nulled without signals
+    _plan_changed(instance.id)
+
+
+@receiver(pre_save, sender=TrainingCycle)
+def bump_cycle_version(sender, instance, raw=False, **kwargs):
+    # incremented in SQL: a stale instance can't reuse a version number
+    if not raw and not instance._state.adding:
+        instance.version = F('version') + 1
+
+
+@receiver(post_save, sender=TrainingCycle)
+def reload_cycle_version(sender, instance, created, raw=False, **kwargs):
+    if not raw and not created:
+        instance.refresh_from_db(fields=['version'])
+
+
+def _day_changed(cycle_id):
+    TrainingCycle.objects.filter(id=cycle_id).update(version=F('version') + 1)
+    _plan_changed(cycle_id)
+
+
+@receiver([post_save, post_delete], sender=CycleDay)
+def cycle_day_changed(sender, instance, **kwargs):
+    _day_changed(instance.cycle_id)
+
+
+@receiver(m2m_changed, sender=CycleDay.muscle_groups.through)
+@receiver(m2m_changed, sender=CycleDay.default_exercises.through)
+def cycle_day_links_changed(sender, instance, action, **kwargs):
+    if action.startswith('post_') and isinstance(instance, CycleDay):
+        _day_changed(instance.cycle_id)
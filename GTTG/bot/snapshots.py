@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import threading
+
+import redis
+from django.db.models import Prefetch
+
+from .catalog_cache import CATALOG_VERSION_KEY
+from .models import Exercise, MuscleGroup, User
+from .serializers import ExerciseSerializer, MuscleGroupSerializer
+from .signals import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Rendered once per catalog version and shared by all web processes. The
+# version is bumped by signals.catalog_changed, so an admin edit makes the
+# next request rebuild it; snapshots of old versions just expire.
+CATALOG_SNAPSHOT_KEY = "cache:catalog_snapshot:{}"
+SNAPSHOT_TTL = 24 * 3600
+
+
+class Snapshot:
+    __slots__ = ("version", "etag", "body")
+
+    def __init__(self, version, etag, body):
+        self.version = version
+        self.etag = etag
+        self.body = body
+
+    def matches(self, if_none_match):
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(tag.removeprefix("W/") == self.etag for tag in tags)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def _catalog_version(client):
+    if client is None:
+        return None
+    try:
+        return client.get(CATALOG_VERSION_KEY) or "0"
+    except redis.RedisError as e:
+        logger.warning("Could not read catalog version: %s", e)
+        return None
+
+
+def build_catalog_snapshot(version):
+    # same shapes as /muscle-groups/ and /exercises/; two queries
+    payload = {
+        "version": version,
+        "muscle_groups": MuscleGroupSerializer(MuscleGroup.objects.order_by("id"), many=True).data,
+        "exercises": ExerciseSerializer(Exercise.objects.select_related("muscle_group").order_by("id"), many=True).data,
+    }
+    body = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
+    # content hash, so a reset version counter can't hand out a stale match
+    etag = '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+    return Snapshot(version, etag, body)
+
+
+def get_catalog_snapshot():
+    global _catalog
+    client = get_redis()
+    version = _catalog_version(client)
+    if version is None:
+        # no Redis: nothing tells us when the catalog changes, so build every time
+        return build_catalog_snapshot(None)
+
+    snapshot = _catalog
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    with _catalog_lock:
+        snapshot = _catalog
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        key = CATALOG_SNAPSHOT_KEY.format(version)
+        try:
+            stored = client.hgetall(key)
+        except redis.RedisError:
+            stored = None
+        if stored:
+            snapshot = Snapshot(version, stored["etag"], stored["body"].encode())
+        else:
+            snapshot = build_catalog_snapshot(version)
+            try:
+                pipe = client.pipeline()
+                pipe.hset(key, mapping={"etag": snapshot.etag, "body": snapshot.body.decode()})
+                pipe.expire(key, SNAPSHOT_TTL)
+                pipe.execute()
+            except redis.RedisError as e:
+                logger.warning("Could not store catalog snapshot: %s", e)
+        _catalog = snapshot
+        return snapshot
+
+
+# Per-user "current plan" snapshot: [status, payload] as JSON. Writes that
+# touch a user's plan bump the user's generation and drop the snapshot; a
+# rebuild that raced with such a write is not stored (see STORE_IF_CURRENT).
+PLAN_SNAPSHOT_KEY = "cache:plan:{}"
+PLAN_GENERATION_KEY = "cache:plan:{}:gen"
+PLAN_SNAPSHOT_TTL = 3600
+
+STORE_IF_CURRENT = """
+if (redis.call('get', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+def build_plan_snapshot(telegram_id):
+    user = User.objects.select_related('current_cycle').filter(telegram_id=telegram_id).first()
+    if user is None:
+        return 404, {'detail': 'Not found.'}
+    cycle = user.current_cycle
+    if cycle is None:
+        return 404, {'detail': 'No current plan.'}
+    days = (
+        cycle.days.order_by('day_number')
+        .prefetch_related('muscle_groups', Prefetch('default_exercises', queryset=Exercise.objects.only('id')))
+    )
+    return 200, {
+        'id': cycle.id,
+        'name': cycle.name,
+        'length': cycle.length,
+        'version': cycle.version,
+        'days': [
+            {
+                'id': day.id,
+                'day_number': day.day_number,
+                'is_training_day': day.is_training_day,
+                'title': day.title,
+                'muscle_groups': [g.id for g in day.muscle_groups.all()],
+                'muscle_group_names': [g.name for g in day.muscle_groups.all()],
+                'default_exercises': [e.id for e in day.default_exercises.all()],
+            }
+            for day in days
+        ],
+    }
+
+
+def get_plan_snapshot(telegram_id):
+    client = get_redis()
+    if client is None:
+        return build_plan_snapshot(telegram_id)
+    key = PLAN_SNAPSHOT_KEY.format(telegram_id)
+    generation_key = PLAN_GENERATION_KEY.format(telegram_id)
+    try:
+        raw = client.get(key)
+        if raw is not None:
+            return tuple(json.loads(raw))
+        generation = client.get(generation_key) or "0"
+    except redis.RedisError as e:
+        logger.warning("Could not read plan snapshot: %s", e)
+        return build_plan_snapshot(telegram_id)
+
+    snapshot = build_plan_snapshot(telegram_id)
+    try:
+        client.eval(
+            STORE_IF_CURRENT, 2, key, generation_key,
+            generation, json.dumps(snapshot, separators=(",", ":")), PLAN_SNAPSHOT_TTL,
+        )
+    except redis.RedisError as e:
+        logger.warning("Could not store plan snapshot: %s", e)
+    return snapshot
+
+
+def invalidate_plan_snapshots(client, telegram_ids):
+    pipe = client.pipeline()
+    for telegram_id in set(telegram_ids):
+        generation_key = PLAN_GENERATION_KEY.format(telegram_id)
+        pipe.incr(generation_key)
+        pipe.expire(generation_key, PLAN_SNAPSHOT_TTL * 2)
+        pipe.delete(PLAN_SNAPSHOT_KEY.format(telegram_id))
+    pipe.execute()
@@ -0,0 +1,108 @@
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+# Sparse fieldsets for GET responses:
+#   ?fields=id,date,exercises.reps   only these fields ("a.b" reaches into a relation)
+#   ?expand=cycle_day,exercises.exercise   relations rendered as nested objects
+# Without either parameter responses are unchanged. Once a client sends one,
+# nested relations it didn't expand come back as ids.
+
+
+def _paths(values):
+    # ["id", "exercises.reps"] -> {"id": [], "exercises": ["reps"]}
+    tree = {}
+    for value in values:
+        head, _, rest = value.strip().partition('.')
+        if head:
+            tree.setdefault(head, [])
+            if rest:
+                tree[head].append(rest)
+    return tree
+
+
+def _spec(only, expand):
+    # a field path that reaches into a relation ("exercises.reps") expands it
+    for name, rest in (only or {}).items():
+        if rest:
+            expand.setdefault(name, [])
+    return only, expand
+
+
+class SparseFieldsMixin:
+
+    def _sparse_spec(self):
+        spec = getattr(self, '_sparse', None)
+        if spec is not None:
+            return spec
+        # only the outermost serializer reads the query string
+        if self.parent is not None and not (isinstance(self.parent, serializers.ListSerializer) and self.parent.parent is None):
+            return None
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        fields = request.query_params.get('fields')
+        expand = request.query_params.get('expand')
+        if fields is None and expand is None:
+            return None
+        return _spec(_paths(fields.split(',')) if fields else None, _paths(expand.split(',')) if expand else {})
+
+    def get_fields(self):
+        fields = super().get_fields()
+        spec = self._sparse_spec()
+        if spec is None:
+            return fields
+        only, expand = spec
+        for name in list(fields):
+            field = fields[name]
+            if field.write_only:
+                continue
+            if only is not None and name not in only:
+                del fields[name]
+                continue
+            many = isinstance(field, serializers.ListSerializer)
+            nested = field.child if many else field
+            if not isinstance(nested, serializers.BaseSerializer):
+                continue
+            if name in expand:
+                nested._sparse = _spec(
+                    _paths(only[name]) if only is not None and only[name] else None,
+                    _paths(expand[name]),
+                )
+            else:
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True, many=many, source=field.source)
+        return fields
+
+
+def related_paths(serializer, prefix='', many=False):
+    # (select_related, prefetch_related) paths for what `serializer` will render
+    select, prefetch = [], []
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        path = prefix + '__'.join(field.source_attrs)
+        if isinstance(field, serializers.ListSerializer):
+            prefetch.append(path)
+            _, nested = related_paths(field.child, path + '__', many=True)
+            prefetch += nested
+        elif isinstance(field, serializers.BaseSerializer):
+            (prefetch if many else select).append(path)
+            nested_select, nested_prefetch = related_paths(field, path + '__', many)
+            select += nested_select
+            prefetch += nested_prefetch
+        elif isinstance(field, serializers.ManyRelatedField):
+            prefetch.append(path)
+    return select, prefetch
+
+
+class SparseQuerysetMixin:
+    # Joins and prefetches only the relations the response renders; runs for
+    # list and detail lookups alike (both go through filter_queryset).
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        select, prefetch = related_paths(self.get_serializer())
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
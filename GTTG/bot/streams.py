@@ -0,0 +1,304 @@
+import json
+import logging
+import math
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+import zlib
+
+import redis
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Updates are appended to updates:{partition}, partitioned by chat id. Every
+# partition has one consumer group; a worker only reads a partition while it
+# holds that partition's lease, so a chat's updates are handled one at a time
+# and in order, while different partitions run in parallel across workers.
+STREAM_KEY = "updates:{}"
+LEASE_KEY = "updates:{}:owner"
+WORKERS_KEY = "updates:workers"
+DEAD_LETTER_KEY = "updates:dead"
+GROUP = "bot"
+PARTITIONS = 16
+STREAM_MAXLEN = 100000
+MAX_DELIVERIES = 5
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+RENEW_LEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def chat_id_of(payload):
+    query = payload.get("callback_query")
+    if query:
+        chat = (query.get("message") or {}).get("chat") or {}
+        return chat.get("id") or query["from"]["id"]
+    for kind in ("message", "edited_message"):
+        if kind in payload:
+            return payload[kind]["chat"]["id"]
+    return None
+
+
+def partition_for(chat_id, partitions=PARTITIONS):
+    if chat_id is None:
+        return 0
+    # stable across processes, unlike hash()
+    return zlib.crc32(str(chat_id).encode()) % partitions
+
+
+def publish_update(client, payload, partitions=PARTITIONS, maxlen=STREAM_MAXLEN):
+    key = STREAM_KEY.format(partition_for(chat_id_of(payload), partitions))
+    entry_id = client.xadd(
+        key, {"update": json.dumps(payload, separators=(",", ":"))}, maxlen=maxlen, approximate=True,
+    )
+    metrics.incr("stream.published")
+    return entry_id
+
+
+class StreamWorker:
+    # One process of the consumer side: keeps a heartbeat in updates:workers,
+    # holds leases on its fair share of partitions and runs one consumer thread
+    # per held partition.
+
+    def __init__(self, client, handle, partitions=PARTITIONS, name=None,
+                 lease_ms=15000, batch=32, block_ms=2000):
+        self.client = client
+        self.handle = handle
+        self.partitions = partitions
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_ms = lease_ms
+        self.batch = batch
+        self.block_ms = block_ms
+        self._owned = {}  # partition -> lease token
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def ensure_groups(self):
+        for partition in range(self.partitions):
+            try:
+                self.client.xgroup_create(STREAM_KEY.format(partition), GROUP, id="0", mkstream=True)
+            except redis.ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    def run(self):
+        self.ensure_groups()
+        logger.info("Stream worker %s consuming %s partitions", self.name, self.partitions)
+        try:
+            while not self._stopping.is_set():
+                try:
+                    live = self._heartbeat()
+                    self._rebalance(live)
+                except redis.RedisError as e:
+                    logger.warning("Stream worker heartbeat failed: %s", e)
+                self._stopping.wait(self.lease_ms / 3000)
+        finally:
+            self._stopping.set()
+            for thread in list(self._threads.values()):
+                thread.join(timeout=self.block_ms / 1000 + 5)
+            try:
+                self.client.zrem(WORKERS_KEY, self.name)
+            except redis.RedisError:
+                pass
+
+    def stop(self):
+        self._stopping.set()
+
+    def _owns(self, partition, token):
+        return not self._stopping.is_set() and self._owned.get(partition) == token
+
+    def _heartbeat(self):
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zadd(WORKERS_KEY, {self.name: now})
+        pipe.zremrangebyscore(WORKERS_KEY, 0, now - self.lease_ms / 1000)
+        pipe.zcard(WORKERS_KEY)
+        with self._lock:
+            owned = list(self._owned.items())
+        for partition, token in owned:
+            pipe.eval(RENEW_LEASE, 1, LEASE_KEY.format(partition), token, self.lease_ms)
+        results = pipe.execute()
+        for (partition, token), renewed in zip(owned, results[3:]):
+            if not renewed:
+                logger.warning("Lost lease on stream partition %s", partition)
+                metrics.incr("stream.lease_lost")
+                self._disown(partition, token)
+        metrics.gauge("stream.partitions_owned", len(self._owned))
+        return results[2]
+
+    def _rebalance(self, live):
+        share = math.ceil(self.partitions / max(live, 1))
+        with self._lock:
+            owned = sorted(self._owned)
+        # hand extra partitions back; their threads stop after the current update
+        for partition in owned[share:]:
+            self._disown(partition, self._owned.get(partition))
+        if len(owned) >= share:
+            return
+        # start from a worker-specific offset so workers don't all race for partition 0
+        start = zlib.crc32(self.name.encode()) % self.partitions
+        for i in range(self.partitions):
+            if len(self._owned) >= share:
+                break
+            partition = (start + i) % self.partitions
+            if partition in self._owned or partition in self._threads:
+                continue
+            token = uuid.uuid4().hex
+            if self.client.set(LEASE_KEY.format(partition), token, nx=True, px=self.lease_ms):
+                self._own(partition, token)
+
+    def _own(self, partition, token):
+        with self._lock:
+            self._owned[partition] = token
+            thread = threading.Thread(
+                target=self._consume, args=(partition, token), name=f"stream-{partition}", daemon=True,
+            )
+            self._threads[partition] = thread
+        thread.start()
+
+    def _disown(self, partition, token):
+        with self._lock:
+            if self._owned.get(partition) == token:
+                del self._owned[partition]
+
+    def _consume(self, partition, token):
+        key = STREAM_KEY.format(partition)
+        try:
+            self._reclaim(key, partition, token)
+            while self._owns(partition, token):
+                reply = self.client.xreadgroup(GROUP, self.name, {key: ">"}, count=self.batch, block=self.block_ms)
+                for _, entries in reply or ():
+                    for entry_id, fields in entries:
+                        if not self._owns(partition, token):
+                            # left pending; the next owner reclaims it in order
+                            return
+                        self._process(key, entry_id, fields)
+        except redis.RedisError as e:
+            logger.warning("Stream partition %s consumer stopped: %s", partition, e)
+        finally:
+            self._disown(partition, token)
+            with self._lock:
+                self._threads.pop(partition, None)
+            try:
+                self.client.eval(RELEASE_LEASE, 1, LEASE_KEY.format(partition), token)
+            except redis.RedisError:
+                pass
+
+    def _reclaim(self, key, partition, token):
+        # Entries a previous owner read but never acked (it died or lost its
+        # lease) come first, oldest first, to keep per-chat order.
+        while self._owns(partition, token):
+            pending = self.client.xpending_range(key, GROUP, min="-", max="+", count=self.batch)
+            if not pending:
+                return
+            deliveries = {p["message_id"]: p["times_delivered"] for p in pending}
+            claimed = self.client.xclaim(key, GROUP, self.name, 0, list(deliveries))
+            claimed_ids = set()
+            for entry_id, fields in claimed:
+                claimed_ids.add(entry_id)
+                if not self._owns(partition, token):
+                    return
+                if deliveries.get(entry_id, 0) >= MAX_DELIVERIES:
+                    self._dead_letter(key, entry_id, fields)
+                else:
+                    metrics.incr("stream.reclaimed")
+                    self._process(key, entry_id, fields)
+            # trimmed entries can't be claimed; drop them from the pending list
+            missing = [i for i in deliveries if i not in claimed_ids]
+            if missing:
+                self.client.xack(key, GROUP, *missing)
+
+    def _process(self, key, entry_id, fields):
+        if fields:
+            try:
+                with metrics.timer("stream.update"):
+                    self.handle(json.loads(fields["update"]))
+            except Exception:
+                # like the polling runtimes: log and move on, don't wedge the chat
+                metrics.incr("stream.failed")
+                logger.exception("Failed to process update %s from %s", entry_id, key)
+            metrics.observe("stream.lag", time.time() - int(entry_id.split("-")[0]) / 1000)
+        self.client.xack(key, GROUP, entry_id)
+        metrics.incr("stream.processed")
+
+    def _dead_letter(self, key, entry_id, fields):
+        logger.error("Update %s from %s failed %s deliveries, moving to %s", entry_id, key, MAX_DELIVERIES, DEAD_LETTER_KEY)
+        pipe = self.client.pipeline()
+        pipe.xadd(DEAD_LETTER_KEY, {"stream": key, "id": entry_id, **(fields or {})}, maxlen=STREAM_MAXLEN, approximate=True)
+        pipe.xack(key, GROUP, entry_id)
+        pipe.execute()
+        metrics.incr("stream.dead_lettered")
+
+
+def _stream_client(bot_module):
+    return redis.Redis.from_url(
+        bot_module.REDIS_URL, decode_responses=True,
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 100)),
+    )
+
+
+def _partitions():
+    return int(os.getenv("UPDATE_STREAM_PARTITIONS", PARTITIONS))
+
+
+def run_consumer(bot_module):
+    from telebot.types import Update
+
+    bot = bot_module.bot
+    bot.threaded = False  # partition threads are the worker pool
+
+    def handle(payload):
+        bot.process_new_updates([Update.de_json(payload)])
+
+    worker = StreamWorker(_stream_client(bot_module), handle, partitions=_partitions())
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+
+
+def run_ingest(bot_module, timeout=30):
+    # Long-polls Telegram and appends to the streams; for deployments that
+    # don't use the webhook. Pending updates are kept: the offset only moves
+    # past an update once it is in Redis.
+    from telebot import apihelper
+
+    client = _stream_client(bot_module)
+    partitions = _partitions()
+    offset = None
+    while True:
+        try:
+            updates = apihelper.get_updates(
+                bot_module.TOKEN, offset=offset, timeout=timeout, allowed_updates=ALLOWED_UPDATES,
+                long_polling_timeout=timeout,
+            )
+        except Exception as e:
+            logger.warning("getUpdates failed: %s", e)
+            time.sleep(3)
+            continue
+        try:
+            for payload in updates:
+                publish_update(client, payload, partitions)
+                offset = payload["update_id"] + 1
+        except redis.RedisError as e:
+            # refetched from the last published offset
+            logger.warning("Could not append update to stream: %s", e)
+            time.sleep(3)
@@ -1,3 +1,348 @@
-from django.test import TestCase
+import datetime
+import threading
+import time
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from rest_framework.test import APITestCase
+from telebot.types import Update
+
+from .callbacks import CallbackRouter
+from .executor import ChatExecutor, update_chat_id
+from .models import CycleDay, Exercise, MuscleGroup, TrainingCycle, User, Workout, WorkoutExercise
+from .quick_entry import MAX_SETS, parse_sets
+from .views import history_cursor
+
+
+def _message_update(update_id, chat_id, text="x"):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "T"},
+        },
+    })
+
+
+class ChatExecutorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.executor = ChatExecutor(num_threads=4, max_pending=3)
+        self.addCleanup(self.executor.close)
+
+    def test_one_chats_tasks_run_in_order(self):
+        ran, done = [], threading.Event()
+
+        def task(n):
+            # the first task is the slowest; order must still hold
+            time.sleep(0.05 if n == 0 else 0)
+            ran.append(n)
+            if n == 2:
+                done.set()
+
+        for n in range(3):
+            self.executor.submit(1, task, n)
+        self.assertTrue(done.wait(2))
+        self.assertEqual(ran, [0, 1, 2])
+
+    def test_chats_run_in_parallel(self):
+        release, other_ran = threading.Event(), threading.Event()
+        self.executor.submit(1, release.wait, 2)
+        self.executor.submit(2, other_ran.set)
+        # chat 2 isn't stuck behind chat 1's blocked task
+        self.assertTrue(other_ran.wait(1))
+        release.set()
+
+    def test_overflow_drops_new_tasks_for_that_chat_only(self):
+        release, ran = threading.Event(), []
+        self.executor.submit(1, release.wait, 2)
+        time.sleep(0.05)  # the blocking task is running, not queued
+        accepted = [self.executor.submit(1, ran.append, n) for n in range(5)]
+        self.assertEqual(accepted, [True, True, True, False, False])
+        self.assertTrue(self.executor.submit(2, ran.append, "other"))
+        release.set()
+        deadline = time.monotonic() + 2
+        while len(ran) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sorted(ran, key=str), [0, 1, 2, "other"])
+
+    def test_failing_task_doesnt_stop_the_chat(self):
+        done = threading.Event()
+        self.executor.submit(1, lambda: 1 / 0)
+        self.executor.submit(1, done.set)
+        self.assertTrue(done.wait(1))
+
+    def test_update_chat_id(self):
+        self.assertEqual(update_chat_id(_message_update(1, 42)), 42)
+        query = Update.de_json({
+            "update_id": 2,
+            "callback_query": {
+                "id": "1", "chat_instance": "x", "data": "1f",
+                "from": {"id": 7, "is_bot": False, "first_name": "T"},
+                "message": {"message_id": 1, "date": 0, "chat": {"id": 42, "type": "private"}, "text": "x"},
+            },
+        })
+        self.assertEqual(update_chat_id(query), 42)
+
+
+class CallbackRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = CallbackRouter()
+        self.calls = []
+
+        def handler(name):
+            return lambda call, *args: self.calls.append((name, args))
+
+        self.router.route("delete_plan", "X", int, legacy={"delete_plan_": None})(handler("delete_plan"))
+        self.router.route("confirm_delete_plan", "x", int,
+                          legacy={"delete_plan_confirm_": None})(handler("confirm_delete_plan"))
+        self.router.route("page", "p", int, legacy={"page_prev": (-1,), "page_next": (1,)})(handler("page"))
+        self.router.route("cancel", "n")(handler("cancel"))
+        self.router.route("tag", "t", int, str)(handler("tag"))
+
+    def matched(self, data):
+        found = self.router.match(data)
+        return None if found is None else (found[0].name, found[1])
+
+    def test_round_trip(self):
+        self.assertEqual(self.router.data("delete_plan", 48), "1X:1c")
+        self.assertEqual(self.matched("1X:1c"), ("delete_plan", (48,)))
+        self.assertEqual(self.matched(self.router.data("page", -1)), ("page", (-1,)))
+        self.assertEqual(self.matched(self.router.data("cancel")), ("cancel", ()))
+        self.assertEqual(self.matched(self.router.data("tag", 3, "legs")), ("tag", (3, "legs")))
+
+    def test_longest_prefix_wins(self):
+        # "delete_plan_" is a prefix of "delete_plan_confirm_"; registration
+        # order mustn't decide which one a button reaches
+        self.assertEqual(self.matched("delete_plan_confirm_12"), ("confirm_delete_plan", (12,)))
+        self.assertEqual(self.matched("delete_plan_12"), ("delete_plan", (12,)))
+
+    def test_legacy_aliases(self):
+        # legacy prefixes are decimal, exact aliases carry fixed arguments
+        self.assertEqual(self.matched("delete_plan_48"), ("delete_plan", (48,)))
+        self.assertEqual(self.matched("page_prev"), ("page", (-1,)))
+        self.assertEqual(self.matched("page_next"), ("page", (1,)))
+        self.assertIsNone(self.matched("page_nextx"))
+
+    def test_bad_arguments_dont_match(self):
+        for data in ("1X:zz!", "1X:", "1X:1:2", "1X", "1n:1", "1t:1", "2X:1c",
+                     "delete_plan_abc", "delete_plan_confirm_", "", "unknown"):
+            with self.subTest(data=data):
+                self.assertIsNone(self.matched(data))
+
+    def test_dispatch(self):
+        call = type("Call", (), {"data": "delete_plan_confirm_7"})()
+        self.assertTrue(self.router.dispatch(call))
+        self.assertEqual(self.calls, [("confirm_delete_plan", (7,))])
+        call.data = "1X:nope!"
+        self.assertFalse(self.router.dispatch(call))
+        self.assertEqual(len(self.calls), 1)
+
+    def test_registration_errors(self):
+        noop = lambda call: None
+        with self.assertRaises(ValueError):
+            self.router.route("cancel", "q")(noop)
+        with self.assertRaises(ValueError):
+            self.router.route("other", "n")(noop)
+        with self.assertRaises(ValueError):
+            self.router.route("bad", "a:b")(noop)
+
+    def test_data_limits(self):
+        with self.assertRaises(TypeError):
+            self.router.data("delete_plan")
+        with self.assertRaises(ValueError):
+            self.router.data("tag", 1, "a:b")
+        with self.assertRaises(ValueError):
+            self.router.data("tag", 1, "x" * 64)
+
+
+class BulkSetsTests(APITestCase):
+    url = "/api/workout-exercises/bulk/"
+
+    def setUp(self):
+        group = MuscleGroup.objects.create(name="Chest")
+        self.press = Exercise.objects.create(name="Bench press", muscle_group=group)
+        self.fly = Exercise.objects.create(name="Fly", muscle_group=group)
+        self.workout = Workout.objects.create(user=User.objects.create(telegram_id=1))
+
+    def post(self, sets, workout=None):
+        return self.client.post(self.url, {"workout": workout or self.workout.id, "sets": sets}, format="json")
+
+    def test_stores_sets_in_request_order(self):
+        sets = [
+            {"exercise": self.press.id, "reps": 5, "weight": 80, "client_id": "a"},
+            {"exercise": self.fly.id, "reps": 12, "weight": 10},
+            {"exercise": self.press.id, "reps": 3, "weight": 90, "client_id": "b"},
+        ]
+        resp = self.post(sets)
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(
+            [(r["exercise"]["id"], r["reps"]) for r in resp.data],
+            [(self.press.id, 5), (self.fly.id, 12), (self.press.id, 3)],
+        )
+        self.workout.refresh_from_db()
+        self.assertEqual((self.workout.total_volume, self.workout.set_count), (80 * 5 + 10 * 12 + 90 * 3, 3))
+
+    def test_resent_client_ids_are_not_stored_again(self):
+        sets = [
+            {"exercise": self.press.id, "reps": 5, "weight": 80, "client_id": "a"},
+            {"exercise": self.press.id, "reps": 5, "weight": 80, "client_id": "a"},
+            {"exercise": self.press.id, "reps": 3, "weight": 90, "client_id": "b"},
+        ]
+        first = self.post(sets)
+        again = self.post(sets)
+        self.assertEqual(again.status_code, 201)
+        self.assertEqual([r["id"] for r in again.data], [r["id"] for r in first.data])
+        self.assertEqual(first.data[0]["id"], first.data[1]["id"])
+        self.assertEqual(WorkoutExercise.objects.filter(workout=self.workout).count(), 2)
+
+    def test_rejects_bad_sets_by_index(self):
+        sets = [
+            {"exercise": self.press.id, "reps": 5, "weight": 80},
+            {"exercise": self.press.id},
+            {"exercise": self.press.id, "reps": "x"},
+            {"exercise": 999999, "reps": 5},
+            {"exercise": self.press.id, "reps": 5, "weight": 80, "client_id": "a"},
+            {"exercise": self.press.id, "reps": 6, "weight": 80, "client_id": "a"},
+        ]
+        resp = self.post(sets)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual([r["index"] for r in resp.data["rejected"]], [1, 2, 3, 5])
+        self.assertEqual(resp.data["rejected"][-1]["error"], "Duplicate client_id")
+        self.assertFalse(WorkoutExercise.objects.exists())
+
+    def test_unknown_workout(self):
+        resp = self.post([{"exercise": self.press.id, "reps": 5}], workout=999999)
+        self.assertEqual(resp.status_code, 404)
+
+
+class WorkoutListPagingTests(APITestCase):
+
+    def setUp(self):
+        user = User.objects.create(telegram_id=1)
+        days = [3, 1, 3, 2, 5, 3, 1]  # back-dated and same-day workouts mixed in by id
+        for day in days:
+            Workout.objects.create(user=user, date=datetime.date(2026, 1, day))
+
+    def test_pages_follow_the_unpaged_list(self):
+        unpaged = [w["id"] for w in self.client.get("/api/workouts/?telegram_id=1").data]
+        paged, url = [], "/api/workouts/?telegram_id=1&page_size=2"
+        while url:
+            page = self.client.get(url).data
+            paged += [w["id"] for w in page["results"]]
+            url = page["next"]
+        self.assertEqual(len(unpaged), 7)
+        self.assertEqual(paged, unpaged)
+
+
+class WorkoutHistoryTests(APITestCase):
+    url = "/api/workouts/history/?telegram_id=1&limit=3"
+
+    def setUp(self):
+        user = User.objects.create(telegram_id=1)
+        for day in [2, 2, 1, 2, 3, 1, 2]:
+            Workout.objects.create(user=user, date=datetime.date(2026, 1, day))
+        self.newest_first = list(
+            Workout.objects.order_by("-date", "-id").values_list("id", flat=True)
+        )
+
+    def walk(self, url, link):
+        pages = []
+        while url:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            pages.append(resp.data)
+            url = resp.data[link] and f"{self.url}&{'after' if link == 'next' else 'before'}={resp.data[link]}"
+        return pages
+
+    def test_pages_to_older_without_gaps_or_repeats(self):
+        pages = self.walk(self.url, "next")
+        self.assertEqual([len(p["results"]) for p in pages], [3, 3, 1])
+        self.assertEqual([w["id"] for p in pages for w in p["results"]], self.newest_first)
+        self.assertIsNone(pages[0]["previous"])
+        self.assertTrue(all(p["previous"] for p in pages[1:]))
+
+    def test_pages_back_to_the_first_page(self):
+        last = self.walk(self.url, "next")[-1]
+        pages = self.walk(f"{self.url}&before={last['previous']}", "previous")
+        self.assertEqual(
+            [[w["id"] for w in p["results"]] for p in pages],
+            [self.newest_first[3:6], self.newest_first[0:3]],
+        )
+        self.assertIsNone(pages[-1]["previous"])
+        self.assertEqual(pages[-1]["next"], history_cursor(Workout.objects.get(id=self.newest_first[2])))
+
+    def test_malformed_cursor(self):
+        for cursor in ("nope", "2026-01-02", "2026-13-01_5", "2026-01-02_x", "a_b_c"):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(f"{self.url}&after={cursor}").status_code, 400)
+                self.assertEqual(self.client.get(f"{self.url}&before={cursor}").status_code, 400)
+
+
+class FullPlanTests(APITestCase):
+    url = "/api/training-cycles/full/"
+
+    def setUp(self):
+        self.chest = MuscleGroup.objects.create(name="Chest")
+        self.back = MuscleGroup.objects.create(name="Back")
+        self.press = Exercise.objects.create(name="Bench press", muscle_group=self.chest)
+        self.row = Exercise.objects.create(name="Row", muscle_group=self.back)
+
+    def plan(self, **day_changes):
+        days = [
+            {"day_number": 1, "muscle_groups": [self.chest.id, self.back.id],
+             "default_exercises": [self.press.id, self.row.id], "title": "Upper"},
+            {"day_number": 2, "is_training_day": False},
+        ]
+        days[1].update(day_changes)
+        return {"name": "Plan", "length": 2, "telegram_id": 1, "days": days}
+
+    def test_creates_the_whole_plan(self):
+        resp = self.client.post(self.url, self.plan(), format="json")
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.data["version"], 1)
+        day1, day2 = resp.data["days"]
+        self.assertEqual((day1["day_number"], day1["title"], day1["is_training_day"]), (1, "Upper", True))
+        self.assertEqual(sorted(day1["muscle_groups"]), sorted([self.chest.id, self.back.id]))
+        self.assertEqual(sorted(day1["default_exercises"]), sorted([self.press.id, self.row.id]))
+        self.assertEqual((day2["day_number"], day2["is_training_day"], day2["muscle_groups"]), (2, False, []))
+        cycle = TrainingCycle.objects.get(id=resp.data["id"])
+        self.assertEqual((cycle.user.telegram_id, cycle.days.count()), (1, 2))
+
+    def test_invalid_plans_leave_nothing_behind(self):
+        for name, changes in [
+            ("duplicate day", {"day_number": 1}),
+            ("unknown group", {"is_training_day": True, "muscle_groups": [999999]}),
+            ("unknown exercise", {"is_training_day": True, "default_exercises": [999999]}),
+        ]:
+            with self.subTest(name):
+                resp = self.client.post(self.url, self.plan(**changes), format="json")
+                self.assertEqual(resp.status_code, 400)
+                self.assertFalse(TrainingCycle.objects.exists())
+                self.assertFalse(CycleDay.objects.exists())
+
+
+class ParseSetsTests(SimpleTestCase):
+
+    def test_repeated_sets(self):
+        self.assertEqual(parse_sets("80x5x3"), [(80.0, 5)] * 3)
+
+    def test_one_set_per_item(self):
+        self.assertEqual(parse_sets("80x5, 85x5, 90x3"), [(80.0, 5), (85.0, 5), (90.0, 3)])
+        self.assertEqual(parse_sets("62.5x8\n65x6;"), [(62.5, 8), (65.0, 6)])
+
+    def test_separators(self):
+        for text in ("80×5", "80х5", "80 * 5", "80X5"):
+            with self.subTest(text=text):
+                self.assertEqual(parse_sets(text), [(80.0, 5)])
+
+    def test_too_many_sets(self):
+        self.assertEqual(len(parse_sets(f"20x5x{MAX_SETS}")), MAX_SETS)
+        self.assertIsNone(parse_sets(f"20x5x{MAX_SETS + 1}"))
+        self.assertIsNone(parse_sets(", ".join(["20x5"] * (MAX_SETS + 1))))
+
+    def test_not_quick_entry(self):
+        for text in ("", "80", "82,5", "80x0", "80x5x0", "80x5, abc", "80x5x3x2", "hello"):
+            with self.subTest(text=text):
+                self.assertIsNone(parse_sets(text))
@@ -4,7 +4,7 @@ from .views import (
     UserViewSet, MuscleGroupViewSet, ExerciseViewSet,
     TrainingCycleViewSet, CycleDayViewSet,
     WorkoutViewSet, WorkoutExerciseViewSet,
-    get_or_create_user,
+    get_or_create_user, catalog,
 )
 
 router = DefaultRouter()
@@ -19,4 +19,5 @@ router.register(r'workout-exercises', WorkoutExerciseViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('auth-user/', get_or_create_user),
+    path('catalog/', catalog),
 ]
@@ -1,37 +1,57 @@
 from rest_framework import viewsets, generics, status
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
-from rest_framework.exceptions import ValidationError
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotFound, ValidationError
 from datetime import date
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http import HttpResponse
 from .models import (
     User, MuscleGroup, Exercise, TrainingCycle, CycleDay, Workout, WorkoutExercise
 )
 from .serializers import (
     UserSerializer, MuscleGroupSerializer, ExerciseSerializer,
-    TrainingCycleSerializer, CycleDaySerializer,
-    WorkoutSerializer, WorkoutExerciseSerializer
+    TrainingCycleSerializer, TrainingCyclePlanSerializer, CycleDaySerializer,
+    WorkoutSerializer, WorkoutExerciseSerializer, WorkoutHistorySerializer
 )
+from .snapshots import get_catalog_snapshot, get_plan_snapshot
+from .sparse import SparseQuerysetMixin
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     lookup_field = "telegram_id"
+    cursor_ordering = 'id'
+
+    @action(detail=True, methods=['get'], url_path='current-plan')
+    def current_plan(self, request, telegram_id=None):
+        # current cycle with its days, group names and default exercise ids in
+        # one call; served from a per-user snapshot, so usually no DB queries
+        try:
+            telegram_id = int(telegram_id)
+        except ValueError:
+            raise NotFound()
+        status_code, data = get_plan_snapshot(telegram_id)
+        return Response(data, status=status_code)
 
 
-class MuscleGroupViewSet(viewsets.ModelViewSet):
+class MuscleGroupViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = MuscleGroup.objects.all()
     serializer_class = MuscleGroupSerializer
+    cursor_ordering = 'id'
 
 
-class ExerciseViewSet(viewsets.ModelViewSet):
+class ExerciseViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = Exercise.objects.all()
     serializer_class = ExerciseSerializer
+    cursor_ordering = 'id'
 
 
-class TrainingCycleViewSet(viewsets.ModelViewSet):
+class TrainingCycleViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = TrainingCycle.objects.all()
     serializer_class = TrainingCycleSerializer
+    cursor_ordering = 'id'
 
     def get_queryset(self):
         queryset = TrainingCycle.objects.all()
@@ -42,10 +62,19 @@ class TrainingCycleViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    @action(detail=False, methods=['post'], url_path='full', serializer_class=TrainingCyclePlanSerializer)
+    def create_full(self, request):
+        # cycle with all its days, muscle groups and default exercises at once
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 
-class CycleDayViewSet(viewsets.ModelViewSet):
+class CycleDayViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = CycleDay.objects.all()
     serializer_class = CycleDaySerializer
+    cursor_ordering = 'id'
 
     def get_queryset(self):
         queryset = CycleDay.objects.all()
@@ -71,12 +100,27 @@ class CycleDayViewSet(viewsets.ModelViewSet):
         return Response(self.get_serializer(instance).data, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+def parse_history_cursor(value):
+    # "<date>_<id>" of the row the page starts after / ends before
+    try:
+        day, pk = value.split('_')
+        return date.fromisoformat(day), int(pk)
+    except (AttributeError, ValueError):
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+
+
+def history_cursor(workout):
+    return f"{workout.date.isoformat()}_{workout.id}"
+
+
+class WorkoutViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    # same order as the unpaged list, over the (user, date, id) index
+    cursor_ordering = ('-date', '-id')
 
     def get_queryset(self):
-        queryset = Workout.objects.all().prefetch_related('muscle_groups', 'exercises__exercise__muscle_group')
+        queryset = Workout.objects.all()
         telegram_id = self.request.query_params.get("telegram_id")
         if telegram_id:
             queryset = queryset.filter(user__telegram_id=telegram_id)
@@ -116,10 +160,62 @@ class WorkoutViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(self.get_serializer(instance).data, status=status.HTTP_201_CREATED, headers=headers)
 
+    HISTORY_PAGE_SIZE = 15
+    HISTORY_MAX_PAGE_SIZE = 100
 
-class WorkoutExerciseViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'], url_path='history', serializer_class=WorkoutHistorySerializer)
+    def history(self, request):
+        # Newest first, keyset-paginated on (date, id) over the
+        # (user, date, id) index: every page costs the same.
+        # ?after=<cursor> pages to older workouts, ?before=<cursor> to newer.
+        telegram_id = request.query_params.get('telegram_id')
+        if not telegram_id:
+            raise ValidationError({'telegram_id': 'This field is required.'})
+        try:
+            limit = min(int(request.query_params.get('limit', self.HISTORY_PAGE_SIZE)), self.HISTORY_MAX_PAGE_SIZE)
+        except ValueError:
+            raise ValidationError({'limit': 'Must be a number.'})
+        limit = max(limit, 1)
+
+        user_id = User.objects.filter(telegram_id=telegram_id).values_list('id', flat=True).first()
+        if user_id is None:
+            return Response({'results': [], 'next': None, 'previous': None})
+
+        queryset = (
+            Workout.objects.filter(user_id=user_id)
+            .select_related('cycle_day')
+            .prefetch_related('muscle_groups')
+        )
+        after = request.query_params.get('after')
+        before = request.query_params.get('before')
+        if before:
+            day, pk = parse_history_cursor(before)
+            rows = list(
+                queryset.filter(Q(date__gt=day) | Q(date=day, id__gt=pk)).order_by('date', 'id')[:limit + 1]
+            )
+            has_more = len(rows) > limit
+            rows = rows[:limit][::-1]
+            has_newer, has_older = has_more, True
+        else:
+            if after:
+                day, pk = parse_history_cursor(after)
+                queryset = queryset.filter(Q(date__lt=day) | Q(date=day, id__lt=pk))
+            rows = list(queryset.order_by('-date', '-id')[:limit + 1])
+            has_older = len(rows) > limit
+            rows = rows[:limit]
+            has_newer = bool(after)
+
+        return Response({
+            'results': self.get_serializer(rows, many=True).data,
+            'next': history_cursor(rows[-1]) if rows and has_older else None,
+            'previous': history_cursor(rows[0]) if rows and has_newer else None,
+        })
+
+
+class WorkoutExerciseViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = WorkoutExercise.objects.all()
     serializer_class = WorkoutExerciseSerializer
+    cursor_ordering = '-id'
 
     def create(self, request, *args, **kwargs):
         workout_id = request.data.get('workout')
@@ -143,6 +239,84 @@ class WorkoutExerciseViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(workout_exercise)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request):
+        # {"workout": id, "sets": [{"exercise": id, "reps": n, "weight": kg, "client_id": "..."}, ...]}
+        # A set whose client_id the workout already has is not stored again.
+        # On 400 "rejected" lists the indexes of the bad sets, so a client can
+        # drop just those and re-send the rest.
+        workout_id = request.data.get('workout')
+        sets = request.data.get('sets')
+
+        if not workout_id or not isinstance(sets, list) or not sets:
+            return Response({'error': 'Missing fields'}, status=status.HTTP_400_BAD_REQUEST)
+        rows, rejected, named = [], [], {}
+        for index, item in enumerate(sets):
+            if not isinstance(item, dict) or not (item.get('exercise') and item.get('reps')):
+                rejected.append({'index': index, 'error': 'Missing fields'})
+                continue
+            try:
+                row = (int(item['exercise']), int(item['reps']), float(item.get('weight') or 0),
+                       str(item['client_id'])[:32] if item.get('client_id') else None)
+                if row[1] < 1 or row[2] < 0:
+                    raise ValueError()
+            except (TypeError, ValueError):
+                rejected.append({'index': index, 'error': 'Invalid exercise, reps or weight'})
+                continue
+            # a resent set repeats its client_id with the same values; another
+            # set under the same id would be dropped as its duplicate
+            if row[3] and named.setdefault(row[3], row) != row:
+                rejected.append({'index': index, 'error': 'Duplicate client_id'})
+                continue
+            rows.append((index, row))
+
+        # one query per table, however many sets
+        try:
+            workout = Workout.objects.get(id=workout_id)
+        except Workout.DoesNotExist:
+            return Response({'error': 'Workout or Exercise not found'}, status=404)
+        exercises = Exercise.objects.select_related('muscle_group').in_bulk({row[0] for _, row in rows})
+        for index, row in rows:
+            if row[0] not in exercises:
+                rejected.append({'index': index, 'error': 'Exercise not found'})
+        if rejected:
+            rejected.sort(key=lambda r: r['index'])
+            return Response({'error': 'Invalid sets', 'rejected': rejected}, status=status.HTTP_400_BAD_REQUEST)
+
+        client_ids = {row[3] for _, row in rows if row[3]}
+        try:
+            with transaction.atomic():
+                stored = {}
+                if client_ids:
+                    stored = {
+                        we.client_id: we for we in
+                        WorkoutExercise.objects.select_related('exercise__muscle_group')
+                        .filter(workout=workout, client_id__in=client_ids)
+                    }
+                new, seen = [], set(stored)
+                for _, (exercise_id, reps, weight, client_id) in rows:
+                    if client_id in seen:
+                        continue
+                    if client_id:
+                        seen.add(client_id)
+                    new.append(WorkoutExercise(
+                        workout=workout, exercise=exercises[exercise_id], reps=reps, weight=weight,
+                        client_id=client_id,
+                    ))
+                created = WorkoutExercise.objects.bulk_create(new)
+                if created:
+                    Workout.refresh_totals(workout.id)
+        except IntegrityError:
+            # the same client ids are being stored by a concurrent request
+            return Response({'error': 'Conflicting write, retry'}, status=status.HTTP_409_CONFLICT)
+
+        # one row per set sent, already stored ones included
+        stored.update((we.client_id, we) for we in created if we.client_id)
+        unnamed = iter(we for we in created if not we.client_id)
+        result = [stored[row[3]] if row[3] else next(unnamed) for _, row in rows]
+        serializer = self.get_serializer(result, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 
 @api_view(['POST'])
 def get_or_create_user(request):
@@ -155,3 +329,17 @@ def get_or_create_user(request):
     user, created = User.objects.get_or_create(telegram_id=telegram_id, defaults={'username': username})
     serializer = UserSerializer(user)
     return Response(serializer.data)
+
+
+@api_view(['GET'])
+def catalog(request):
+    # muscle groups + exercises in one precomputed body; clients revalidate
+    # with If-None-Match and get an empty 304 while the catalog is unchanged
+    snapshot = get_catalog_snapshot()
+    if snapshot.matches(request.headers.get('If-None-Match')):
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = HttpResponse(snapshot.body, content_type='application/json')
+    response['ETag'] = snapshot.etag
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,85 @@
+import hmac
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from redis import RedisError
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN"
+
+
+class UpdateDispatcher:
+    # Hands updates to the bot's per-chat dispatch layer (executor.py) so the
+    # webhook can ack at once; one chat's updates still run in order.
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._bot_module = None
+        self._lock = threading.Lock()
+
+    @property
+    def bot_module(self):
+        if self._bot_module is None:
+            with self._lock:
+                if self._bot_module is None:
+                    from . import bot as bot_module
+                    bot_module.chats.start(self.workers)
+                    self._bot_module = bot_module
+        return self._bot_module
+
+    def submit(self, payload):
+        from telebot.types import Update
+        try:
+            update = Update.de_json(payload)
+        except Exception:
+            logger.exception("Failed to parse update %s", payload.get("update_id"))
+            return
+        self.bot_module.dispatch(update)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = UpdateDispatcher(settings.TELEGRAM_WEBHOOK_WORKERS)
+    return _dispatcher
+
+
+@csrf_exempt
+@require_POST
+def telegram_webhook(request):
+    secret = settings.TELEGRAM_WEBHOOK_SECRET
+    # as bytes: compare_digest raises TypeError on non-ASCII str
+    received = request.META.get(SECRET_HEADER, "").encode("utf-8", "surrogateescape")
+    if not secret or not hmac.compare_digest(received, secret.encode()):
+        return HttpResponseForbidden()
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest()
+    if not isinstance(payload, dict) or "update_id" not in payload:
+        return HttpResponseBadRequest()
+
+    if settings.TELEGRAM_UPDATE_STREAM:
+        from .signals import get_redis
+        from .streams import publish_update
+        try:
+            publish_update(get_redis(), payload, settings.UPDATE_STREAM_PARTITIONS)
+        except RedisError as e:
+            # non-2xx makes Telegram redeliver the update later
+            logger.warning("Could not append update to stream: %s", e)
+            return HttpResponse(status=503)
+    else:
+        get_dispatcher().submit(payload)
+    return HttpResponse(status=200)
@@ -0,0 +1,90 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def run_polling(bot_module, timeout=20, skip_pending=True):
+    # long polling; every update goes through the per-chat dispatch layer
+    bot = bot_module.bot
+    offset = None
+    if skip_pending:
+        pending = bot.get_updates(offset=-1, timeout=10, long_polling_timeout=0)
+        if pending:
+            offset = pending[-1].update_id + 1
+    while True:
+        try:
+            updates = bot.get_updates(offset=offset, timeout=timeout + 10, long_polling_timeout=timeout)
+        except Exception as e:
+            logger.error("getUpdates failed: %s", e)
+            time.sleep(3)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            bot_module.dispatch(update)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the GTTG Telegram bot worker.")
+    parser.add_argument(
+        "--runtime", choices=["sync", "async", "stream", "ingest"], default=os.getenv("BOT_RUNTIME", "sync"),
+        help="sync: threaded TeleBot long polling; async: asyncio event loop with pooled async clients; "
+             "stream: consume updates from Redis Streams (run any number); "
+             "ingest: long-poll Telegram into Redis Streams (run one, or use the webhook)",
+    )
+    parser.add_argument(
+        "--session-report", type=int, nargs="?", const=200, metavar="SAMPLE",
+        help="print MEMORY USAGE stats for a sample of stored sessions and exit",
+    )
+    parser.add_argument(
+        "--expire-legacy-sessions", action="store_true",
+        help="give old user:{id}:data session blobs the session TTL and exit "
+             "(returning users have theirs migrated on first load)",
+    )
+    parser.add_argument(
+        "--set-buffer-lag", action="store_true",
+        help="print how many logged sets are waiting in the write-behind buffer and exit",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
+    from . import bot as bot_module
+
+    if args.session_report:
+        print(json.dumps(bot_module.sessions.memory_report(args.session_report), indent=2))
+        return
+    if args.expire_legacy_sessions:
+        print(json.dumps({"expired": bot_module.sessions.expire_legacy()}))
+        return
+    if args.set_buffer_lag:
+        print(json.dumps(bot_module.set_buffer.lag(), indent=2))
+        return
+    if bot_module.WRITE_BEHIND:
+        # flushes buffers a previous worker left behind
+        bot_module.set_buffer.start()
+
+    if args.runtime == "stream":
+        from .streams import run_consumer
+        print("Bot consuming update streams...")
+        run_consumer(bot_module)
+    elif args.runtime == "ingest":
+        from .streams import run_ingest
+        print("Bot polling into update streams...")
+        run_ingest(bot_module)
+    elif args.runtime == "async":
+        from .aio import run_async
+        print("Bot polling (async)...")
+        run_async(bot_module)
+    else:
+        print("Bot polling...")
+        try:
+            run_polling(bot_module)
+        except KeyboardInterrupt:
+            bot_module.chats.close()
+
+
+if __name__ == '__main__':
+    main()